@@ -0,0 +1,209 @@
+'''
+benchmarks of the numerical hot paths of the package, which do not need
+blender, run them with benchmarks/run.py
+
+each benchmark is a function which takes its parameters, does any setup, and
+returns a function (with no arguments) which is timed
+'''
+import os
+import math
+import tempfile
+import numpy as np
+from scipy import integrate
+
+import pose_estimation.tools.math as tm
+import pose_estimation.tools.image as ti
+import pose_estimation.gramian.functions as gf
+import pose_estimation.gramian.rigid_body as gr
+import pose_estimation.gramian.trajectories as gt
+
+# random numbers are seeded so every run benchmarks the same inputs
+rng = np.random.RandomState(0)
+
+
+def random_quat(n):
+    '''
+    n random unit quaternions, size (4, n)
+    '''
+
+    q = rng.randn(4, n)
+
+    return q/np.linalg.norm(q, axis=0)
+
+
+def random_gram(n):
+    '''
+    n random (symmetric positive definite) Gramians, size (6, 6, n)
+    '''
+
+    A = rng.randn(6, 6, n)
+
+    return np.einsum('ijn,kjn->ikn', A, A) + 1e-3*np.eye(6)[:,:,np.newaxis]
+
+
+def perturbation_images(res, frac=.1):
+    '''
+    synthetic perturbation images: 12 uint8 RGB images of size (res, res, 3)
+    of a static background, where a square "object" which covers a fraction
+    frac of the image is different in each image
+    order of images: -1, +1, -2, +2, ...
+    '''
+
+    bkgd = rng.randint(0, 256, (res, res, 3)).astype(np.uint8)
+    ims = np.repeat(bkgd[np.newaxis], 12, axis=0)
+    n_ob = int(res*math.sqrt(frac))
+    ims[:, :n_ob, :n_ob, :] = rng.randint(0, 256, (12, n_ob, n_ob, 3))
+
+    return ims
+
+
+# benchmarks
+def bench_standard_pert(n):
+    xyz = rng.randn(3, n)
+    quat = random_quat(n)
+
+    def run():
+        for i in range(n):
+            gf.standard_pert(xyz[:,i], quat[:,i])
+
+    return run
+
+
+def bench_gramian_measures(n):
+    gram = random_gram(n)
+
+    def run():
+        gf.gramian_measures(gram)
+
+    return run
+
+
+def bench_integrate_kinematics(n_t):
+    t = np.linspace(0, 2, n_t)
+    v_om = rng.randn(6, n_t)
+    xyz_q_0 = np.concatenate((np.zeros(3), random_quat(1)[:,0]))
+
+    def run():
+        gr.integrate_kinematics(t, v_om, xyz_q_0)
+
+    return run
+
+
+def bench_newton_euler(n_t):
+    t = np.linspace(0, 2, n_t)
+    v_om_0 = np.array([3, 5, 9, 3, 2, 1.5])
+
+    def run():
+        integrate.solve_ivp(gr.newton_euler, [t[0], t[-1]], v_om_0,
+                            method='RK45', t_eval=t)
+
+    return run
+
+
+def bench_semicircle(n_coord):
+    def run():
+        gt.semicircle(5, n_coord, .3, .7, np.zeros((3, 1)))
+
+    return run
+
+
+def bench_mat2quat(n):
+    R = tm.quat2mat(random_quat(n))
+
+    def run():
+        tm.mat2quat(R)
+
+    return run
+
+
+def bench_overlay(res):
+    im_overlay = rng.rand(res, res, 4).astype(np.float32)
+    im_bkgd = rng.rand(res, res, 3).astype(np.float32)
+
+    def run():
+        ti.overlay(im_overlay, im_bkgd)
+
+    return run
+
+
+def bench_load_im_np(res):
+    im = rng.randint(0, 256, (res, res, 4)).astype(np.uint8)
+    im_file = os.path.join(tempfile.mkdtemp(), 'im.png')
+    ti.write_im_np(im_file, im/255.0)
+
+    def run():
+        ti.load_im_np(im_file)
+
+    return run
+
+
+def bench_load_im_int(res):
+    im = rng.randint(0, 256, (res, res, 4)).astype(np.uint8)
+    im_file = os.path.join(tempfile.mkdtemp(), 'im.png')
+    ti.write_im_np(im_file, im/255.0)
+
+    def run():
+        ti.load_im_int(im_file)
+
+    return run
+
+
+def perturbation_files(res):
+    '''
+    perturbation_images() saved as pngs, lists of the files of the negative
+    and positive perturbation of each state
+    '''
+
+    ims = perturbation_images(res)
+    im_dir = tempfile.mkdtemp()
+    files = [os.path.join(im_dir, '%02d.png' % k) for k in range(12)]
+    for im_file, im in zip(files, ims):
+        ti.write_im_np(im_file, im/255.0)
+
+    return files[0::2], files[1::2]
+
+
+def jtj_benchmark(res, use_int_diff, use_sparse):
+    '''
+    gramian of one render from its perturbation images, as it is computed by
+    compute_gramian_object() (loading and comparing the images of each state
+    with gf.decode_state(), then gf.finish_gramian())
+    '''
+    files_neg, files_pos = perturbation_files(res)
+
+    def run():
+        states = [gf.decode_state([neg], [pos], use_int_diff=use_int_diff,
+                                  use_sparse=use_sparse, remove=False)
+                  for neg, pos in zip(files_neg, files_pos)]
+        gf.finish_gramian(states, 1e-2, use_sparse)
+
+    return run
+
+
+def bench_jtj_float(res):
+    return jtj_benchmark(res, False, False)
+
+
+def bench_jtj_int(res):
+    return jtj_benchmark(res, True, False)
+
+
+def bench_jtj_sparse(res):
+    return jtj_benchmark(res, True, True)
+
+
+# (name, benchmark function, parameter name, parameter values)
+benchmarks = [
+    ('standard_pert', bench_standard_pert, 'n', [1, 100]),
+    ('gramian_measures', bench_gramian_measures, 'n', [1, 100, 1000]),
+    ('integrate_kinematics', bench_integrate_kinematics, 'n_t',
+        [301, 3001]),
+    ('newton_euler', bench_newton_euler, 'n_t', [301, 3001]),
+    ('semicircle', bench_semicircle, 'n_coord', [10, 100, 1000]),
+    ('mat2quat', bench_mat2quat, 'n', [1, 1000, 100000]),
+    ('overlay', bench_overlay, 'res', [300, 1000]),
+    ('load_im_np', bench_load_im_np, 'res', [300, 1000]),
+    ('load_im_int', bench_load_im_int, 'res', [300, 1000]),
+    ('jtj_float', bench_jtj_float, 'res', [100, 300, 1000]),
+    ('jtj_int', bench_jtj_int, 'res', [100, 300, 1000]),
+    ('jtj_sparse', bench_jtj_sparse, 'res', [100, 300, 1000])]
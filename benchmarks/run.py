@@ -0,0 +1,126 @@
+'''
+run the benchmarks of benchmarks/hot_paths.py and save the results, so they
+can be compared with the results of other runs (e.g. before and after an
+optimization, or between commits)
+
+python benchmarks/run.py [--filter name] [--compare results_file]
+
+results are saved to benchmarks/results/<commit>_<time>.json, with --compare
+the ratio (this run)/(other run) of the time of each benchmark is printed
+'''
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import numpy as np
+
+# make pose_estimation importable without installing it
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_dir))
+sys.path.insert(0, bench_dir)
+
+import hot_paths
+
+results_dir = os.path.join(bench_dir, 'results')
+
+
+def time_func(func, n_repeat=5, t_min=.2):
+    '''
+    time a function: the number of calls per repeat is chosen so each repeat
+    takes at least t_min seconds, the minimum and median time per call over
+    the repeats are returned
+    '''
+
+    # number of calls per repeat
+    t_start = time.perf_counter()
+    func()
+    t_call = time.perf_counter() - t_start
+    n_calls = max(1, int(t_min/max(t_call, 1e-9)))
+
+    # time repeats
+    t = np.full(n_repeat, np.nan)
+    for i in range(n_repeat):
+        t_start = time.perf_counter()
+        for j in range(n_calls):
+            func()
+        t[i] = (time.perf_counter() - t_start)/n_calls
+
+    return np.amin(t), np.median(t)
+
+
+def git_commit():
+    '''
+    the current git commit, or 'unknown'
+    '''
+
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                             cwd=bench_dir, stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL)
+        return out.stdout.decode().strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+
+def run_benchmarks(name_filter=None):
+    '''
+    run all benchmarks whose name contains name_filter, and return a
+    dictionary of results
+    '''
+
+    results = {}
+    for name, bench, param_name, param_vals in hot_paths.benchmarks:
+        if name_filter is not None and name_filter not in name:
+            continue
+
+        for val in param_vals:
+            key = '%s(%s=%s)' % (name, param_name, val)
+            t_min, t_med = time_func(bench(val))
+            results[key] = {'min': t_min, 'median': t_med}
+            print('%-40s %12.6f s %12.6f s' % (key, t_min, t_med))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filter', default=None,
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--compare', default=None,
+                        help='results file to compare this run with')
+    args = parser.parse_args()
+
+    # run
+    print('%-40s %14s %14s' % ('benchmark', 'min', 'median'))
+    results = run_benchmarks(args.filter)
+
+    # save
+    commit = git_commit()
+    run = {'commit': commit,
+           'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+           'machine': platform.node(),
+           'processor': platform.processor(),
+           'python': platform.python_version(),
+           'numpy': np.__version__,
+           'results': results}
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    results_file = os.path.join(results_dir, '%s_%s.json' % (
+        commit, time.strftime('%Y%m%d_%H%M%S')))
+    with open(results_file, 'w') as output:
+        json.dump(run, output, indent=1)
+    print('saved results to', results_file)
+
+    # compare
+    if args.compare is not None:
+        with open(args.compare, 'r') as input:
+            other = json.load(input)
+        print('\ncompared with', other['commit'], other['time'])
+        print('%-40s %14s' % ('benchmark', 'time ratio'))
+        for key, val in results.items():
+            if key in other['results']:
+                ratio = val['min']/other['results'][key]['min']
+                print('%-40s %14.3f' % (key, ratio))
@@ -0,0 +1,38 @@
+'''
+this script is to be run as a blender command:
+
+blender --background --python detect_symmetry.py -- model_name [...]
+
+it detects the symmetry of each model (of its mesh and the lamps of its
+scene, see pose_estimation.gramian.symmetry.detect_symmetry()), and caches it
+next to the model's .blend file
+
+in this package, this script is usually not called directly: it is called by
+pose_estimation.gramian.symmetry.model_symmetry() the first time the symmetry
+of a model is used
+'''
+import sys
+
+import pose_estimation.blender.functions as bf
+import pose_estimation.gramian.symmetry as gs
+from pose_estimation.blender.scene import SceneManager
+
+# get arguments (all args after "--")
+argv = sys.argv
+model_names = argv[argv.index("--") + 1:]
+
+scene_manager = SceneManager()
+for model_name in model_names:
+    ob = scene_manager.load_model(model_name)
+
+    # a world color which is set by a texture (e.g. an environment map) is
+    # not symmetric in general, a uniform world color is
+    world_bkgd = scene_manager.world_background()
+    if world_bkgd is not None and world_bkgd.is_linked:
+        sym = None
+    else:
+        lamp_xyz, lamp_dir = bf.object_lamps(ob)
+        sym = gs.detect_symmetry(bf.object_vertices(ob), lamp_xyz, lamp_dir)
+
+    gs.save_symmetry(model_name, sym)
+    print(model_name, 'symmetry:', sym)
@@ -0,0 +1,444 @@
+'''
+run render jobs (job directories with manifests, see
+pose_estimation.blender.manifest) on several render nodes, or on several local
+worker processes which stand in for nodes
+
+jobs are submitted to a queue, which is an sqlite database on a file system
+which all of the nodes share, the jobs are split into shards, and each worker
+repeatedly claims a shard and renders it (a few jobs per blender session), the
+results (e.g. gramian.npy) are written to the job directories, so they are on
+the shared file system too
+
+a worker holds a lease on its shard, which it renews after every chunk of jobs
+it renders, if a worker crashes or hangs, its lease expires and the shard is
+given to another worker, failed shards are retried up to max_attempts times,
+and a worker which finds no shards in the queue steals the second half of the
+jobs which have not been started from the shard which has the most of them
+
+to submit jobs and run local workers:
+    import pose_estimation.blender.executor as be
+    be.submit(db_file, job_dirs)
+    be.run_local(db_file, n_workers)
+and to run workers on each render node (e.g. over ssh), where n_workers
+workers split the node's cpus between them:
+python -m pose_estimation.blender.executor worker db_file [n_workers] [--wait]
+python -m pose_estimation.blender.executor status db_file
+'''
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import subprocess
+import traceback
+import multiprocessing
+import numpy as np
+
+import pose_estimation.blender.render as br
+import pose_estimation.blender.manifest as bm
+
+# shard states
+TODO = 'todo'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# defaults
+shard_size = 16 # jobs per shard
+chunk_size = 4 # jobs per blender session
+lease_time = 3600.0 # seconds a worker has to finish a chunk of jobs
+max_attempts = 3
+poll_time = 2.0 # seconds an idle worker waits before checking the queue
+
+schema = '''
+create table if not exists shards (
+    id integer primary key,
+    job_dirs text not null,
+    n_done integer not null default 0,
+    n_started integer not null default 0,
+    state text not null default 'todo',
+    worker text,
+    lease real,
+    attempts integer not null default 0,
+    error text);
+create table if not exists workers (
+    name text primary key,
+    threads integer,
+    jobs integer not null default 0,
+    failed integer not null default 0,
+    wall real not null default 0,
+    cpu real not null default 0)
+'''
+
+
+def connect(db_file):
+    '''
+    open the queue database (creating it if it does not exist), transactions
+    are started explicitly, see transaction()
+    '''
+
+    con = sqlite3.connect(db_file, timeout=60, isolation_level=None)
+    con.executescript(schema)
+
+    return con
+
+
+class transaction:
+    '''
+    with transaction(con):
+        ...
+    runs the block in an immediate transaction, i.e. the database is locked
+    for writing at the start of the block, so claims are atomic
+    '''
+
+    def __init__(self, con):
+        self.con = con
+
+    def __enter__(self):
+        self.con.execute('begin immediate')
+        return self.con
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.con.execute('commit')
+        else:
+            self.con.execute('rollback')
+
+
+def worker_name():
+    '''
+    name of this worker process, unique over all nodes
+    '''
+
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def submit(db_file, job_dirs, size=shard_size):
+    '''
+    add jobs to the queue, in shards of (at most) size jobs, and return the
+    shard ids
+    '''
+
+    job_dirs = [os.path.abspath(d) for d in job_dirs]
+    con = connect(db_file)
+    ids = []
+    with transaction(con):
+        for i in range(0, len(job_dirs), size):
+            cur = con.execute('insert into shards (job_dirs) values (?)',
+                              (json.dumps(job_dirs[i:i+size]),))
+            ids.append(cur.lastrowid)
+    con.close()
+
+    return ids
+
+
+def expire_leases(con, attempts=max_attempts):
+    '''
+    put the shards of workers whose leases have expired back in the queue,
+    jobs which were started but not finished are rendered again, or like
+    fail(), mark them as failed if they have been attempted attempts times
+    '''
+
+    con.execute('update shards set state=(case when attempts<? then ? else ? '
+                'end), worker=null, lease=null, n_started=n_done, '
+                'error=(case when attempts<? then error else ? end) '
+                'where state=? and lease<?',
+                (attempts, TODO, FAILED, attempts, 'lease expired', RUNNING,
+                 time.time()))
+
+
+def claim(con, worker, lease=lease_time, attempts=max_attempts):
+    '''
+    claim a shard for worker, if there is no shard in the queue, steal part of
+    a running shard
+
+    output: shard id, or None if there is nothing to do
+    '''
+
+    with transaction(con):
+        expire_leases(con, attempts)
+        row = con.execute('select id from shards where state=? and '
+                          'attempts<? order by id limit 1',
+                          (TODO, attempts)).fetchone()
+        if row is not None:
+            shard_id = row[0]
+            con.execute('update shards set state=?, worker=?, lease=?, '
+                        'attempts=attempts+1 where id=?',
+                        (RUNNING, worker, time.time() + lease, shard_id))
+            return shard_id
+
+        return steal(con, worker, lease)
+
+
+def steal(con, worker, lease=lease_time):
+    '''
+    move the second half of the jobs which have not been started out of the
+    running shard which has the most of them, into a new shard for worker
+    (must be called inside of a transaction)
+
+    output: id of the new shard, or None if there is nothing to steal
+    '''
+
+    victim = None
+    n_most = 1 # a shard must have at least 2 unstarted jobs to be split
+    rows = con.execute('select id, job_dirs, n_started from shards where '
+                       'state=?', (RUNNING,)).fetchall()
+    for shard_id, job_dirs, n_started in rows:
+        job_dirs = json.loads(job_dirs)
+        n_unstarted = len(job_dirs) - n_started
+        if n_unstarted > n_most:
+            victim = (shard_id, job_dirs, n_started)
+            n_most = n_unstarted
+    if victim is None:
+        return None
+
+    shard_id, job_dirs, n_started = victim
+    split = n_started + (len(job_dirs) - n_started + 1)//2
+    con.execute('update shards set job_dirs=? where id=?',
+                (json.dumps(job_dirs[:split]), shard_id))
+    cur = con.execute('insert into shards (job_dirs, state, worker, lease, '
+                      'attempts) values (?, ?, ?, ?, 1)',
+                      (json.dumps(job_dirs[split:]), RUNNING, worker,
+                       time.time() + lease))
+
+    return cur.lastrowid
+
+
+def next_chunk(con, shard_id, worker, size=chunk_size, lease=lease_time):
+    '''
+    mark the next chunk of jobs of a shard as started, and renew the lease
+
+    output: list of job directories (empty if the shard is finished), or None
+            if the worker no longer holds the shard (its lease expired)
+    '''
+
+    with transaction(con):
+        row = con.execute('select job_dirs, n_done, state, worker from '
+                          'shards where id=?', (shard_id,)).fetchone()
+        job_dirs, n_done, state, owner = row
+        if state != RUNNING or owner != worker:
+            return None
+
+        job_dirs = json.loads(job_dirs)
+        chunk = job_dirs[n_done:n_done+size]
+        if not chunk:
+            con.execute('update shards set state=?, lease=null where id=?',
+                        (DONE, shard_id))
+        else:
+            con.execute('update shards set n_started=?, lease=? where id=?',
+                        (n_done + len(chunk), time.time() + lease, shard_id))
+
+    return chunk
+
+
+def finish_chunk(con, shard_id, worker):
+    '''
+    mark the started chunk of jobs of a shard as done
+    '''
+
+    with transaction(con):
+        con.execute('update shards set n_done=n_started where id=? and '
+                    'state=? and worker=?', (shard_id, RUNNING, worker))
+
+
+def fail(con, shard_id, worker, error, attempts=max_attempts):
+    '''
+    give a shard back to the queue after an error, or mark it as failed if it
+    has been attempted attempts times (jobs which were finished are kept)
+    '''
+
+    with transaction(con):
+        con.execute('update shards set state=(case when attempts<? then ? '
+                    'else ? end), worker=null, lease=null, n_started=n_done, '
+                    'error=? where id=? and state=? and worker=?',
+                    (attempts, TODO, FAILED, error, shard_id, RUNNING,
+                     worker))
+
+
+def record_usage(con, worker, threads, n_jobs, proc, failed=False):
+    '''
+    add the wall and cpu time of a blender run to the worker's usage, and its
+    n_jobs jobs if it succeeded, or one failed run if it failed
+    '''
+
+    with transaction(con):
+        con.execute('insert or ignore into workers (name, threads) values '
+                    '(?, ?)', (worker, threads))
+        if failed:
+            con.execute('update workers set failed=failed+1 where name=?',
+                        (worker,))
+        else:
+            con.execute('update workers set jobs=jobs+? where name=?',
+                        (n_jobs, worker))
+        con.execute('update workers set wall=wall+?, cpu=cpu+? where name=?',
+                    (proc.wall_time, proc.cpu_time, worker))
+
+
+def check_jobs(job_dirs):
+    '''
+    check that jobs which compute Gramians have written all of them, raise a
+    RuntimeError if not
+    '''
+
+    for job_dir in job_dirs:
+        render_props = bm.read_manifest(job_dir)
+        if not render_props.compute_gramian:
+            continue
+        gram_file = os.path.join(job_dir, bm.gramian_name)
+        if not os.path.isfile(gram_file) or \
+           np.any(np.isnan(bm.load_gramian(job_dir, mmap_mode='r'))):
+            raise RuntimeError('job ' + job_dir + ' did not write its '
+                               'Gramians')
+
+
+def run_worker(db_file, lease=lease_time, attempts=max_attempts,
+               size=chunk_size, wait=False, budget=None):
+    '''
+    claim and render shards until the queue is finished (all shards are done
+    or failed), or if wait is True, forever
+
+    budget is the worker's thread budget (see
+    pose_estimation.blender.render.thread_budget()), if None blender uses all
+    cpus
+
+    output: number of jobs this worker rendered
+    '''
+
+    worker = worker_name()
+    con = connect(db_file)
+    if budget is not None:
+        threads = budget['threads']
+    else:
+        threads = os.cpu_count()
+    n_jobs = 0
+    while True:
+        shard_id = claim(con, worker, lease, attempts)
+        if shard_id is None:
+            if not wait and finished(con):
+                break
+            time.sleep(poll_time)
+            continue
+
+        while True:
+            chunk = next_chunk(con, shard_id, worker, size, lease)
+            if not chunk:
+                break # done, or the lease expired and the shard was taken
+
+            proc = None
+            try:
+                proc = br.blender_render(chunk, timeout=lease, budget=budget)
+                if proc.returncode != 0:
+                    raise RuntimeError('blender exited with code %d'
+                                       % proc.returncode)
+                check_jobs(chunk)
+            except (RuntimeError, OSError, ValueError,
+                    subprocess.TimeoutExpired):
+                if proc is not None:
+                    record_usage(con, worker, threads, 0, proc, failed=True)
+                fail(con, shard_id, worker, traceback.format_exc(), attempts)
+                break
+
+            record_usage(con, worker, threads, len(chunk), proc)
+            finish_chunk(con, shard_id, worker)
+            n_jobs += len(chunk)
+
+    con.close()
+
+    return n_jobs
+
+
+def finished(con):
+    '''
+    check if all shards are done or failed
+    '''
+
+    row = con.execute('select count(*) from shards where state in (?, ?)',
+                      (TODO, RUNNING)).fetchone()
+
+    return row[0] == 0
+
+
+def status(db_file):
+    '''
+    number of shards and jobs in each state, the errors of failed shards, and
+    the usage of each worker: jobs per second, and utilization (the fraction
+    of the worker's threads' time which was spent on the cpu)
+    '''
+
+    con = connect(db_file)
+    stat = {state: {'shards': 0, 'jobs': 0}
+            for state in [TODO, RUNNING, DONE, FAILED]}
+    errors = {}
+    for shard_id, job_dirs, state, error in con.execute(
+            'select id, job_dirs, state, error from shards'):
+        stat[state]['shards'] += 1
+        stat[state]['jobs'] += len(json.loads(job_dirs))
+        if state == FAILED:
+            errors[shard_id] = error
+    workers = {}
+    for name, threads, jobs, failed, wall, cpu in con.execute(
+            'select name, threads, jobs, failed, wall, cpu from workers'):
+        workers[name] = {'threads': threads, 'jobs': jobs,
+                         'failed_runs': failed, 'wall': wall,
+                         'cpu': cpu, 'jobs_per_s': jobs/max(wall, 1e-9),
+                         'utilization': cpu/max(wall*threads, 1e-9)}
+    con.close()
+    stat['errors'] = errors
+    stat['workers'] = workers
+
+    return stat
+
+
+def run_local(db_file, n_workers, lease=lease_time, attempts=max_attempts,
+              size=chunk_size, budget=True):
+    '''
+    run n_workers worker processes on this computer until the queue is
+    finished, and return status(db_file)
+
+    if budget is True, the cpus are split between the workers (see
+    pose_estimation.blender.render.thread_budget()), it can also be a list of
+    budgets, one per worker, or None for no budgets
+    '''
+
+    if budget is True:
+        budgets = br.thread_budget(n_workers)
+    elif budget is None:
+        budgets = [None]*n_workers
+    else:
+        budgets = budget
+    procs = [multiprocessing.Process(target=run_worker,
+                                     args=(db_file, lease, attempts, size,
+                                           False, budgets[k]))
+             for k in range(n_workers)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+
+    return status(db_file)
+
+
+if __name__ == '__main__':
+    cmd, db_file = sys.argv[1:3]
+    args = sys.argv[3:]
+    wait = '--wait' in args
+    if wait:
+        args.remove('--wait')
+    if cmd == 'worker' and not args:
+        run_worker(db_file, wait=wait)
+    elif cmd == 'worker':
+        n_workers = int(args[0])
+        procs = [multiprocessing.Process(target=run_worker,
+                                         args=(db_file, lease_time,
+                                               max_attempts, chunk_size, wait,
+                                               budget))
+                 for budget in br.thread_budget(n_workers)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+    elif cmd == 'status':
+        print(json.dumps(status(db_file), indent=1))
+    else:
+        raise ValueError('unknown command ' + cmd)
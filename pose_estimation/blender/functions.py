@@ -1,14 +1,38 @@
 import os
 import bpy
-import time
 import math
+import contextlib
+import collections
+import concurrent.futures
 import numpy as np
-import imageio
-import transforms3d as t3d
 
 import pose_estimation.directories as dirs
+import pose_estimation.tools.math as tm
 import pose_estimation.tools.image as ti
+import pose_estimation.tools.scratch as ts
+import pose_estimation.tools.timing as tt
+import pose_estimation.tools.dataset as td
 import pose_estimation.gramian.functions as gf
+import pose_estimation.blender.manifest as bm
+
+
+def set_changed(owner, attr, value):
+    '''
+    set owner.attr = value, only if it is different, so blender does not tag
+    data which has not changed for an update (with persistent render data,
+    data which is not tagged is not synced again, e.g. the world shader is not
+    recompiled when only the object moves)
+    '''
+
+    cur = getattr(owner, attr)
+    if isinstance(value, (str, bool)):
+        same = cur == value
+    else:
+        # blender stores floats as float32
+        same = np.array_equal(np.float32(np.ravel(cur)),
+                              np.float32(np.ravel(value)))
+    if not same:
+        setattr(owner, attr, value)
 
 
 def render_image(
@@ -17,150 +41,592 @@ def render_image(
     '''
     set the camera and object to a position and orientation, take, and save an
     image
+
+    only what has changed since the last render is set, so consecutive renders
+    which only move the object (or the camera) are transform-only updates
     '''
 
-    cam_ob.location = cam_pos
-    cam_ob.rotation_mode = 'QUATERNION'
-    cam_ob.rotation_quaternion = cam_quat
+    set_changed(cam_ob, 'location', cam_pos)
+    set_changed(cam_ob, 'rotation_mode', 'QUATERNION')
+    set_changed(cam_ob, 'rotation_quaternion', cam_quat)
 
-    ob.location = ob_pos
-    ob.rotation_mode = 'QUATERNION'
-    ob.rotation_quaternion = ob_quat
+    set_changed(ob, 'location', ob_pos)
+    set_changed(ob, 'rotation_mode', 'QUATERNION')
+    set_changed(ob, 'rotation_quaternion', ob_quat)
     bpy.data.scenes['Scene'].render.filepath = image_file
 
     if world_RGB is not None:
         A = np.array([1.0]) # alpha for world RGBA lighting
         RGBA = np.concatenate((world_RGB, A))
-        bpy.data.worlds['World'].node_tree.nodes['Background'].inputs[0]. \
-            default_value = RGBA
+        set_changed(bpy.data.worlds['World'].node_tree.nodes['Background'].
+                    inputs[0], 'default_value', RGBA)
 
+    scene = bpy.data.scenes['Scene']
     if not alpha:
-        bpy.data.scenes['Scene'].render.image_settings.color_mode = 'RGB'
-        bpy.data.scenes['Scene'].cycles.film_transparent = False
+        set_changed(scene.render.image_settings, 'color_mode', 'RGB')
+        set_changed(scene.cycles, 'film_transparent', False)
 
     else:
-        bpy.data.scenes['Scene'].render.image_settings.color_mode = 'RGBA'
-        bpy.data.scenes['Scene'].cycles.film_transparent = True
+        set_changed(scene.render.image_settings, 'color_mode', 'RGBA')
+        set_changed(scene.cycles, 'film_transparent', True)
 
-    bpy.ops.render.render(write_still=True)
+    with tt.span('render_image'):
+        bpy.ops.render.render(write_still=True)
+    tt.count('renders')
 
 
-def compute_gramian_object(render_props):
+def render_alpha(render_props, i):
     '''
-    compute the empirical observability Gramian for each render
+    get the alpha (transparent background) flag of the i'th render, since
+    render_props.alpha can be a single bool or a list of bools
     '''
 
-    # scalars, vectors, and arrays
-    n_states = 6 # x, y, z, x-rot, y-rot, z-rot
-    n_el = 3*render_props.pix_width*render_props.pix_height
-    mat = np.full((n_el, n_states), np.nan) # matrix of y^+ - y^- vectors
-    # gramian for all renders
-    gram = np.full((n_states, n_states, render_props.n_renders), np.nan)
-
-    # check if background images are to be used load background image
-    if render_props.bkgd_image_list is None:
-        use_bkgd_image = False
+    if np.ndim(render_props.alpha) == 0:
+        return bool(render_props.alpha)
     else:
-        use_bkgd_image = True
+        return bool(render_props.alpha[i])
+
+
+def set_background(render_props, i):
+    '''
+    set the image the compositor superimposes renders on to the i'th
+    background image (see
+    pose_estimation.blender.scene.SceneManager.background_compositor()), the
+    image is only reloaded if it has changed
+    '''
+
+    image = render_props.bkgd_node.image
+    image_file = os.path.abspath(render_props.bkgd_image_list[i])
+    if image.filepath != image_file:
+        image.filepath = image_file
+        image.reload()
+
+
+def object_corners(ob):
+    '''
+    corners of the bounding boxes of the object ob and all of its children,
+    expressed in the (scaled) coordinate frame of ob, so that if ob is at
+    position xyz with rotation matrix R, the corners are at R @ corners + xyz
+
+    output: corners, size (3, 8 * number of meshes)
+    '''
+
+    bpy.context.scene.update() # make sure world matrices are up to date
+    scl = np.diag(np.append(np.array(ob.scale), 1))
+    ob_mat = scl @ np.linalg.inv(np.array(ob.matrix_world))
+
+    # loop over ob and its children (and their children, ...)
+    corners = []
+    obs = [ob]
+    while obs:
+        ob_k = obs.pop()
+        obs.extend(ob_k.children)
+        if ob_k.type != 'MESH':
+            continue
+        mat_k = ob_mat @ np.array(ob_k.matrix_world)
+        for co in ob_k.bound_box:
+            corners.append(mat_k @ np.append(np.array(co), 1))
+
+    return np.array(corners)[:,:3].T
+
+
+def object_vertices(ob):
+    '''
+    vertices of the meshes of the object ob and all of its children, expressed
+    in the (scaled) coordinate frame of ob, e.g. to detect the symmetry of a
+    model with pose_estimation.gramian.symmetry.detect_symmetry()
+
+    output: vertices, size (3, number of vertices)
+    '''
+
+    bpy.context.scene.update() # make sure world matrices are up to date
+    scl = np.diag(np.append(np.array(ob.scale), 1))
+    ob_mat = scl @ np.linalg.inv(np.array(ob.matrix_world))
+
+    # loop over ob and its children (and their children, ...)
+    verts = []
+    obs = [ob]
+    while obs:
+        ob_k = obs.pop()
+        obs.extend(ob_k.children)
+        if ob_k.type != 'MESH':
+            continue
+        mat_k = ob_mat @ np.array(ob_k.matrix_world)
+        co = np.array([v.co for v in ob_k.data.vertices])
+        co = np.concatenate((co, np.ones((co.shape[0], 1))), axis=1)
+        verts.append(co @ mat_k.T)
+
+    return np.concatenate(verts)[:,:3].T
 
-    # generic save files
-    temp_file_neg = os.path.join(dirs.gramian_image_save_dir,
-                                 'temp_%d_neg.png')
-    temp_file_pos = os.path.join(dirs.gramian_image_save_dir,
-                                 'temp_%d_pos.png')
-
-    # loop through renders
-    for i in range(0, render_props.n_renders):
-
-        # i'th position, quaternion, and perturbations
-        xyz_i = render_props.xyz[:,i]
-        quat_i = render_props.quat[:,i]
-        if render_props.pert_xyz is None and render_props.pert_quat is None:
-            pert_xyz_i, pert_quat_i = gf.standard_pert(xyz_i, quat_i,
-                                                       render_props.eps)
+
+def object_lamps(ob):
+    '''
+    positions and directions of the lamps of the scene, expressed in the
+    (scaled) coordinate frame of ob, e.g. to check that the lighting has the
+    symmetry of the model with
+    pose_estimation.gramian.symmetry.detect_symmetry()
+
+    the direction of a lamp is the direction it shines in (its -z axis), or
+    zero for point lamps, which shine in all directions
+
+    outputs: positions and directions, size (3, number of lamps) each
+    '''
+
+    bpy.context.scene.update() # make sure world matrices are up to date
+    scl = np.diag(np.append(np.array(ob.scale), 1))
+    ob_mat = scl @ np.linalg.inv(np.array(ob.matrix_world))
+
+    lamp_xyz = []
+    lamp_dir = []
+    for ob_k in bpy.context.scene.objects:
+        if ob_k.type != 'LAMP':
+            continue
+        mat_k = ob_mat @ np.array(ob_k.matrix_world)
+        lamp_xyz.append(mat_k[:3,3])
+        if ob_k.data.type == 'POINT':
+            lamp_dir.append(np.zeros(3))
         else:
-            pert_xyz_i = render_props.pert_xyz[:,:,i]
-            pert_quat_i = render_props.pert_quat[:,:,i]
+            dir_k = -mat_k[:3,2]
+            lamp_dir.append(dir_k/np.linalg.norm(dir_k))
+
+    return np.reshape(lamp_xyz, (-1, 3)).T, np.reshape(lamp_dir, (-1, 3)).T
+
+
+def camera_view(points, cam_xyz, cam_quat, cam, pix_width, pix_height):
+    '''
+    project points into the image of a camera, like
+    bpy_extras.object_utils.world_to_camera_view(), but from the position and
+    quaternion of the camera rather than its world matrix (which blender only
+    updates for objects which are linked to the scene, and the cameras are
+    not)
+
+    inputs:
+        points: points in the world frame, size (3, n)
+        cam_xyz, cam_quat: position and quaternion of the camera
+        cam: camera data (lens, sensor_width, sensor_height, sensor_fit)
+        pix_width, pix_height: size of the image in pixels
+
+    outputs: x, y, z, size (n) each, x and y on the interval [0, 1] (measured
+             from the lower left corner of the image) for points in the
+             image, z is the depth in front of the camera
+    '''
 
-        # if we are using a background image, get it
-        if use_bkgd_image:
-            bkgd_image = ti.load_im_np(render_props.bkgd_image_list[i])
+    # points in the camera frame, the camera looks along its -z axis
+    R = tm.quat2mat(np.ravel(cam_quat))
+    co = R.T @ (points - np.reshape(cam_xyz, (3, 1)))
+    z = -co[2]
 
-        # set world_RGB for i'th render
-        if render_props.world_RGB is None:
-            world_RGB_i = None
+    # focal length as a fraction of the width or height the sensor fits to
+    if cam.sensor_fit == 'VERTICAL' or \
+       (cam.sensor_fit == 'AUTO' and pix_height > pix_width):
+        if cam.sensor_fit == 'VERTICAL':
+            sensor = cam.sensor_height
         else:
-            world_RGB_i = render_props.world_RGB[:,i]
+            sensor = cam.sensor_width
+        f_y = cam.lens/sensor
+        f_x = f_y*pix_height/pix_width
+    else:
+        f_x = cam.lens/cam.sensor_width
+        f_y = f_x*pix_width/pix_height
 
-        # loop through states
-        for j in range(0, n_states):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = 0.5 + f_x*co[0]/z
+        y = 0.5 + f_y*co[1]/z
 
-            # perturbations in the negative direction
-            temp_file_neg_j = temp_file_neg % j 
-            temp_file_pos_j = temp_file_pos % j 
-            pert_xyz_minus_ij = pert_xyz_i[:,2*j]
-            pert_quat_minus_ij = pert_quat_i[:,2*j]
-            pert_xyz_plus_ij = pert_xyz_i[:,2*j+1]
-            pert_quat_plus_ij = pert_quat_i[:,2*j+1]
+    return x, y, z
 
-            # render positive & negative images
-            render_image(
-                cam_ob=render_props.cam_ob,
-                cam_pos=render_props.cam_xyz,
-                cam_quat=render_props.cam_quat,
-                ob=render_props.ob,
-                ob_pos=pert_xyz_minus_ij,
-                ob_quat=pert_quat_minus_ij,
-                image_file=temp_file_neg_j,
-                world_RGB=world_RGB_i,
-                alpha=render_props.alpha)
 
+def render_border(render_props, corners, pert_xyz, pert_quat, cam=None):
+    '''
+    region of the image which contains the object under all perturbations,
+    padded by render_props.roi_pad pixels
+
+    only the object's bounding boxes are used, so shadows and reflections of
+    the object which fall outside of the region (and which change under the
+    perturbations) are not rendered, and do not contribute to the gramian,
+    roi_pad can be increased to include more of them
+
+    inputs:
+        corners: corners of the object's bounding boxes (see object_corners)
+        pert_xyz: xyz of the perturbations, size (3, n_perts)
+        pert_quat: quat of the perturbations, size (4, n_perts)
+        cam: (camera object, xyz, quat) of the camera (see rig_cameras()), if
+             None the camera of render_props
+
+    output: (x_min, x_max, y_min, y_max) on the interval [0, 1], measured from
+            the lower left corner of the image, or None if the region cannot
+            be found (e.g. part of the object is behind the camera)
+    '''
+
+    if cam is None:
+        cam = (render_props.cam_ob, render_props.cam_xyz,
+               render_props.cam_quat)
+    cam_ob, cam_xyz, cam_quat = cam
+
+    # project the corners of every perturbation
+    R = tm.quat2mat(pert_quat)
+    corners_all = np.concatenate([R[k] @ corners + pert_xyz[:,[k]]
+                                  for k in range(pert_xyz.shape[1])], axis=1)
+    x, y, z = camera_view(corners_all, cam_xyz, cam_quat, cam_ob.data,
+                          render_props.pix_width, render_props.pix_height)
+    if np.any(z <= 0):
+        return None
+
+    # bounding box of the projected corners, in pixels
+    W = render_props.pix_width
+    H = render_props.pix_height
+    pad = render_props.roi_pad
+    x_min = max(math.floor(np.amin(x)*W) - pad, 0)
+    x_max = min(math.ceil(np.amax(x)*W) + pad, W)
+    y_min = max(math.floor(np.amin(y)*H) - pad, 0)
+    y_max = min(math.ceil(np.amax(y)*H) + pad, H)
+    if x_min >= x_max or y_min >= y_max:
+        return None
+
+    return (x_min/W, x_max/W, y_min/H, y_max/H)
+
+
+def set_render_border(border):
+    '''
+    only render (and save) the region of the image given by border, see
+    render_border(), if border is None the entire image is rendered
+    '''
+
+    render = bpy.data.scenes['Scene'].render
+    if border is None:
+        render.use_border = False
+        render.use_crop_to_border = False
+    else:
+        render.border_min_x, render.border_max_x, \
+            render.border_min_y, render.border_max_y = border
+        render.use_border = True
+        render.use_crop_to_border = True
+
+
+def rig_cameras(render_props):
+    '''
+    cameras which render each image: the camera of render_props, or if it has a
+    camera rig, each camera of the rig
+
+    output: list of (camera object, xyz, quat) of each camera
+    '''
+
+    if render_props.rig_xyz is None:
+        return [(render_props.cam_ob, render_props.cam_xyz,
+                 render_props.cam_quat)]
+
+    # poses of the rig cameras are relative to the camera of render_props
+    cam_xyz = np.ravel(render_props.cam_xyz)
+    cam_quat = np.ravel(render_props.cam_quat)
+    cam_R = tm.quat2mat(cam_quat)
+    cams = []
+    for k, cam_ob_k in enumerate(render_props.rig_obs):
+        xyz_k = cam_xyz + cam_R @ np.asarray(render_props.rig_xyz)[:,k]
+        quat_k = tm.quat_mult(cam_quat, np.asarray(render_props.rig_quat)[:,k])
+        cams.append((cam_ob_k, xyz_k, quat_k))
+
+    return cams
+
+
+def render_pair(render_props, cams, pert_xyz_i, pert_quat_i, j,
+                image_files_neg, image_files_pos, world_RGB_i, alpha_i,
+                borders=None):
+    '''
+    render the images of the negative and positive perturbations of the j'th
+    state, the object is moved once for each perturbation, and every camera of
+    cams (see rig_cameras()) renders it
+
+    image_files_neg, image_files_pos: image file of each camera
+    borders: render border of each camera (see render_border()), or None
+    '''
+
+    scene = bpy.data.scenes['Scene']
+    for k, image_files in [(2*j, image_files_neg), (2*j+1, image_files_pos)]:
+        for c, (cam_ob, cam_xyz, cam_quat) in enumerate(cams):
+            if scene.camera != cam_ob:
+                scene.camera = cam_ob
+            if borders is not None:
+                set_render_border(borders[c])
             render_image(
-                cam_ob=render_props.cam_ob,
-                cam_pos=render_props.cam_xyz,
-                cam_quat=render_props.cam_quat,
+                cam_ob=cam_ob,
+                cam_pos=cam_xyz,
+                cam_quat=cam_quat,
                 ob=render_props.ob,
-                ob_pos=pert_xyz_plus_ij,
-                ob_quat=pert_quat_plus_ij,
-                image_file=temp_file_pos_j,
+                ob_pos=pert_xyz_i[:,k],
+                ob_quat=pert_quat_i[:,k],
+                image_file=image_files[c],
                 world_RGB=world_RGB_i,
-                alpha=render_props.alpha)
+                alpha=alpha_i)
 
-            # overlay render on background image?
+
+def deltas_files(render_props, i, n_cams):
+    '''
+    files which the sparse differences of the i'th render are saved to (one
+    per camera), or None if they are not saved
+    '''
+
+    if not (render_props.sparse_diff and render_props.save_deltas):
+        return None
+    if render_props.rig_xyz is None:
+        names = ['deltas_%06d.npz' % i]
+    else:
+        names = ['deltas_%06d_cam%d.npz' % (i, c) for c in range(n_cams)]
+
+    return [os.path.join(render_props.save_dir, name) for name in names]
+
+
+@tt.timed('compute_gramian_object')
+def compute_gramian_object(render_props, gram=None, noise=None,
+                           gram_cams=None):
+    '''
+    compute the empirical observability Gramian for each render
+
+    the gramian is of the states of render_props.states, and only their
+    perturbations are rendered, below, n is the number of these states
+
+    gram: optional preallocated array of size (n, n, n_renders) (e.g. a memory
+          map) which each Gramian is written into as soon as it is computed,
+          with a camera rig, it is the Gramian of the rig (the sum of the
+          Gramians of its cameras)
+    noise: if render_props.noise_floor, optional preallocated array of size
+           (n, n, n_renders) which the noise floor of each Gramian is written
+           into (see render_props.noise_floor)
+    gram_cams: with a camera rig, optional preallocated array of size
+               (n, n, n_cams, n_renders) which the Gramian of each camera is
+               written into
+
+    output: gram, or if render_props.noise_floor or a camera rig is used,
+            (gram, noise, gram_cams), where outputs which are not used are
+            None
+    '''
+
+    # scalars, vectors, and arrays
+    states = gf.gramian_states(render_props.states) # of x, y, z, x-rot, ...
+    n_states = len(states)
+    # gramian for all renders
+    if gram is None:
+        gram = np.full((n_states, n_states, render_props.n_renders), np.nan)
+
+    # cameras, and gramians of each camera of a camera rig
+    scene = bpy.data.scenes['Scene']
+    use_rig = render_props.rig_xyz is not None
+    n_cams = len(rig_cameras(render_props))
+    if use_rig and gram_cams is None:
+        gram_cams = np.full((n_states, n_states, n_cams,
+                             render_props.n_renders), np.nan)
+
+    # estimate the noise floor? the sampling seed is changed for the second
+    # rendering of each pair, and changed back
+    use_noise_floor = render_props.noise_floor
+    if use_noise_floor:
+        if noise is None:
+            noise = np.full(gram.shape, np.nan)
+        seed = scene.cycles.seed
+
+    # check if background images are to be used load background image
+    if render_props.bkgd_image_list is None:
+        use_bkgd_image = False
+    else:
+        use_bkgd_image = True
+
+    # perturbation images as uncompressed float OpenEXR files (linear, the
+    # compositor superimposes them on background images in linear color too),
+    # these are not integers
+    use_exr = render_props.gramian_format == 'OPEN_EXR'
+    if use_exr:
+        image_settings = scene.render.image_settings
+        file_format = image_settings.file_format
+        color_depth = image_settings.color_depth
+        image_settings.file_format = 'OPEN_EXR'
+        image_settings.color_depth = '32'
+        image_settings.exr_codec = 'NONE'
+        ext = '.exr'
+    else:
+        ext = '.png'
+
+    # images can be kept as integers, and their differences computed as
+    # integers (background images are superimposed by the compositor, so the
+    # saved images are integers too)
+    use_int_diff = render_props.int_diff and not use_exr
+
+    # only render the region of the image which contains the object? pixels
+    # outside of it are the same for all perturbations, so they do not change
+    # the gramian (the region is not used with background images, since the
+    # compositor superimposes the whole render on the whole background image)
+    use_roi = render_props.roi and not use_bkgd_image
+    if use_roi:
+        corners = object_corners(render_props.ob)
+
+    # generic save files (of the i'th render, j'th state, and c'th camera), in
+    # a scratch directory which is unique to this job and is removed when all
+    # gramians have been computed
+    # the renders are a pipeline: blender renders the states back to back,
+    # while a pool of gramian_processes worker processes loads and compares
+    # the images of each render and computes its gramian (processes rather
+    # than threads, since blender holds the GIL while it renders, the workers
+    # are forked when the pool starts, so they do not import bpy again)
+    with ts.scratch_dir(dirs.gramian_image_save_dir, 'gramian_') as temp_dir, \
+         concurrent.futures.ProcessPoolExecutor(
+             render_props.gramian_processes) as pool:
+        temp_file_neg = os.path.join(temp_dir, 'temp_%d_%d_%d_neg' + ext)
+        temp_file_pos = os.path.join(temp_dir, 'temp_%d_%d_%d_pos' + ext)
+        temp_file_neg_b = os.path.join(temp_dir, 'temp_%d_%d_%d_neg_b' + ext)
+        temp_file_pos_b = os.path.join(temp_dir, 'temp_%d_%d_%d_pos_b' + ext)
+        pending = collections.deque() # (i, future) of gramians in the pool
+
+        def finish_next():
+            i, future = pending.popleft()
+            with tt.span('wait_gramian'):
+                gram_i, noise_i, gram_cams_i = future.result()
+            gram[:,:,i] = gram_i
+            if use_noise_floor:
+                noise[:,:,i] = noise_i
+            if gram_cams is not None:
+                gram_cams[:,:,:,i] = gram_cams_i
+
+        # loop through renders
+        for i in range(0, render_props.n_renders):
+
+            # i'th position, quaternion, and perturbations
+            xyz_i = render_props.xyz[:,i]
+            quat_i = render_props.quat[:,i]
+            if render_props.pert_xyz is None and \
+               render_props.pert_quat is None:
+                pert_xyz_i, pert_quat_i = gf.standard_pert(xyz_i, quat_i,
+                                                           render_props.eps)
+            else:
+                pert_xyz_i = render_props.pert_xyz[:,:,i]
+                pert_quat_i = render_props.pert_quat[:,:,i]
+
+            # if we are using a background image, set it
             if use_bkgd_image:
-                # negative
-                # entries from 0 to 1
-                overlay_image = ti.load_im_np(temp_file_neg_j)
-                bkgd_image = ti.load_im_np(render_props.bkgd_image_list[i])
-                y_minus = ti.overlay(overlay_image, bkgd_image)
-
-                # positive
-                # entries from 0 to 1
-                overlay_image = ti.load_im_np(temp_file_pos_j)
-                bkgd_image = ti.load_im_np(render_props.bkgd_image_list[i])
-                y_plus = ti.overlay(overlay_image, bkgd_image)
+                set_background(render_props, i)
+
+            # set world_RGB for i'th render
+            if render_props.world_RGB is None:
+                world_RGB_i = None
+            else:
+                world_RGB_i = render_props.world_RGB[:,i]
+            alpha_i = render_alpha(render_props, i)
 
+            # for each camera
+            cams = rig_cameras(render_props)
+
+            # region of the image to render, the same for all perturbations
+            if use_roi:
+                borders = [render_border(render_props, corners, pert_xyz_i,
+                                         pert_quat_i, cam) for cam in cams]
             else:
-                # negative
-                y_minus = ti.load_im_np(temp_file_neg_j)[:,:,:3] # no alpha
-
-                # positive
-                y_plus = ti.load_im_np(temp_file_pos_j)[:,:,:3] # no alpha
-            
-            # compare positive to negative perturbations
-            y_diff = y_plus - y_minus
-            y_diff_vec = np.reshape(y_diff, n_el)
-            mat[:,j] = y_diff_vec
-
-        # compute gramian
-        gram[:, :, i] = (1/(4*render_props.eps**2))*mat.T @ mat
+                borders = None
+
+            # loop through states
+            image_files = [] # (neg, pos, neg_b, pos_b) files of each state
+            for j in states:
+
+                # render positive & negative images with every camera
+                temp_files_neg_j = [temp_file_neg % (i, j, c)
+                                    for c in range(n_cams)]
+                temp_files_pos_j = [temp_file_pos % (i, j, c)
+                                    for c in range(n_cams)]
+                render_pair(render_props, cams, pert_xyz_i, pert_quat_i, j,
+                            temp_files_neg_j, temp_files_pos_j, world_RGB_i,
+                            alpha_i, borders)
+
+                # render the pair again with a different seed, the difference
+                # of the two differences is only sampling noise
+                if use_noise_floor:
+                    temp_files_neg_b = [temp_file_neg_b % (i, j, c)
+                                        for c in range(n_cams)]
+                    temp_files_pos_b = [temp_file_pos_b % (i, j, c)
+                                        for c in range(n_cams)]
+                    scene.cycles.seed = seed + 1
+                    render_pair(render_props, cams, pert_xyz_i, pert_quat_i,
+                                j, temp_files_neg_b, temp_files_pos_b,
+                                world_RGB_i, alpha_i, borders)
+                    scene.cycles.seed = seed
+                else:
+                    temp_files_neg_b = None
+                    temp_files_pos_b = None
+                image_files.append((temp_files_neg_j, temp_files_pos_j,
+                                    temp_files_neg_b, temp_files_pos_b))
+
+            # compare the images and compute the gramian in a worker process,
+            # while the next render is rendered
+            pending.append((i, pool.submit(
+                gf.gramian_from_images, image_files, render_props.eps,
+                use_int_diff, use_exr, render_props.sparse_diff,
+                deltas_files(render_props, i, n_cams))))
+
+            # at most gramian_pending renders are in the pipeline, which
+            # bounds the memory and disk space of their images
+            while len(pending) > render_props.gramian_pending:
+                finish_next()
+
+        while pending:
+            finish_next()
+
+    if use_roi:
+        set_render_border(None)
+    if use_exr:
+        image_settings.file_format = file_format
+        image_settings.color_depth = color_depth
+    if use_rig:
+        scene.camera = render_props.cam_ob
+
+    if use_noise_floor or use_rig:
+        return gram, noise, gram_cams
+
     return gram
 
 
-def render_pose(render_props):
+def render_pose_i(render_props, i, image_file):
     '''
-    render the object at different x, y, and z locations and orientations (as
-    quaternions)
+    render the object at the i'th pose of render_props, with its world color
+    and background image (the compositor superimposes the render on the i'th
+    background image, if there is a list of them), and save it to image_file
+    '''
+
+    # different world color?
+    if render_props.world_RGB is not None:
+        world_RGB_i = render_props.world_RGB[:, i]
+    else:
+        world_RGB_i = None
+
+    # background image
+    if render_props.bkgd_image_list is not None:
+        set_background(render_props, i)
+
+    render_image(
+        cam_ob=render_props.cam_ob,
+        cam_pos=render_props.cam_xyz,
+        cam_quat=render_props.cam_quat,
+        ob=render_props.ob,
+        ob_pos=render_props.xyz[:,i],
+        ob_quat=render_props.quat[:,i],
+        image_file=image_file,
+        alpha=render_alpha(render_props, i),
+        world_RGB=world_RGB_i)
+
+
+@contextlib.contextmanager
+def png_compression(compression):
+    '''
+    set the png compression of the scene (0 to 100) in a with block, and set
+    it back afterwards, even if the block raises an exception
+    '''
+
+    image_settings = bpy.data.scenes['Scene'].render.image_settings
+    compression_old = image_settings.compression
+    image_settings.compression = compression
+    try:
+        yield
+    finally:
+        image_settings.compression = compression_old
+
+
+def render_images(render_props):
+    '''
+    render the object at each pose, and save one png per pose
     '''
 
     # preliminary things
@@ -170,41 +636,138 @@ def render_pose(render_props):
     # loop through poses to generate images
     for i in range(render_props.n_renders):
 
-        # different world color?
-        if render_props.world_RGB is not None:
-            world_RGB_i = render_props.world_RGB[:, i]
-        else:
-            world_RGB_i = None
-       
         # give the image a name
         if render_props.image_names is None:
             image_file_name_i = image_numerical_name % i
         else:
             image_file_name_i = render_props.image_names[i]
         image_file_i = os.path.join(render_props.save_dir, image_file_name_i)
-        
+
         # render image i
-        render_image(
-            cam_ob=render_props.cam_ob,
-            cam_pos=render_props.cam_xyz,
-            cam_quat=render_props.cam_quat,
-            ob=render_props.ob,
-            ob_pos=render_props.xyz[:,i],
-            ob_quat=render_props.quat[:,i],
-            image_file=image_file_i,
-            alpha=render_props.alpha,
-            world_RGB=world_RGB_i)
-
-        # if we have a list of background images, overlay render onto
-        # background
-        if render_props.bkgd_image_list is not None:
-            im_i = ti.load_im_np(image_file_i)
-            im_bkgd_i = ti.load_im_np(render_props.bkgd_image_list[i])
-            im_overlay = ti.overlay(im_i, im_bkgd_i)
-            ti.write_im_np(image_file_i, im_overlay)
-
-    # compute gramian for all renders, then save data
+        render_pose_i(render_props, i, image_file_i)
+
+
+def render_dataset(render_props):
+    '''
+    render the object at each pose, and write the images and their pose labels
+    to sharded tar files in save_dir (see pose_estimation/tools/dataset.py),
+    images are encoded by a pool of worker processes while blender renders
+    the next poses (background images are superimposed by the compositor)
+    '''
+
+    # blender saves uncompressed pngs, which are quick to write, the shard
+    # writer compresses them
+    with png_compression(0), \
+         ts.scratch_dir(dirs.gramian_image_save_dir, 'dataset_') as temp_dir, \
+         td.ShardWriter(render_props.save_dir,
+                        shard_size=render_props.shard_size,
+                        n_processes=render_props.dataset_processes) as writer:
+        for i in range(render_props.n_renders):
+
+            # key of the sample
+            if render_props.image_names is None:
+                key_i = '%06d' % i
+            else:
+                key_i = os.path.splitext(render_props.image_names[i])[0]
+
+            # render image i to the scratch directory (the shard writer
+            # removes it when it has been encoded)
+            image_file_i = os.path.join(temp_dir, '%06d.png' % i)
+            render_pose_i(render_props, i, image_file_i)
+
+            # label
+            label_i = {'model_name': render_props.model_name,
+                       'xyz': np.asarray(render_props.xyz[:,i]),
+                       'quat': np.asarray(render_props.quat[:,i]),
+                       'cam_xyz': np.ravel(render_props.cam_xyz),
+                       'cam_quat': np.ravel(render_props.cam_quat)}
+            if render_props.bkgd_image_list is not None:
+                label_i['bkgd_image'] = render_props.bkgd_image_list[i]
+            writer.add(key_i, image_file_i, label_i)
+
+
+def render_frames(render_props):
+    '''
+    render the object at each pose, and write the images to the shared result
+    array render_props.frame_file (see
+    pose_estimation.blender.manifest.create_shared_result()) instead of
+    saving them
+    '''
+
+    frames = bm.result_view(render_props.frame_file,
+                            render_props.result_offset,
+                            render_props.n_renders, axis=0)
+
+    # blender saves uncompressed pngs to a scratch directory (on a tmpfs, if
+    # there is one), which are only read back
+    with png_compression(0), \
+         ts.scratch_dir(dirs.gramian_image_save_dir, 'frames_') as temp_dir:
+        image_file = os.path.join(temp_dir, 'frame.png')
+        for i in range(render_props.n_renders):
+
+            # render image i
+            render_pose_i(render_props, i, image_file)
+
+            # copy it to the shared array, images without alpha are opaque
+            with tt.span('load_images'):
+                im = ti.load_im_int(image_file)
+            frames[i,:,:,:3] = im[:,:,:3]
+            if im.shape[2] == 4:
+                frames[i,:,:,3] = im[:,:,3]
+            else:
+                frames[i,:,:,3] = 255
+
+    frames.flush()
+
+
+def render_pose(render_props):
+    '''
+    render the object at different x, y, and z locations and orientations (as
+    quaternions)
+    '''
+
+    # one png per pose, a sharded dataset, or a shared array of frames
+    if render_props.dataset:
+        render_dataset(render_props)
+    elif render_props.frame_file is not None:
+        render_frames(render_props)
+    else:
+        render_images(render_props)
+
+    # compute gramian for all renders, streaming them into gramian.npy, or
+    # into the shared result array
     if render_props.compute_gramian:
-        gram_file = os.path.join(render_props.save_dir, 'gramian.npz')
-        gram = compute_gramian_object(render_props)
-        np.savez(gram_file, gram=gram)
+        n_states = len(gf.gramian_states(render_props.states))
+        if render_props.result_file is None:
+            gram = bm.open_gramian(render_props.save_dir,
+                                   (n_states, n_states,
+                                    render_props.n_renders))
+        else:
+            gram = bm.result_view(render_props.result_file,
+                                  render_props.result_offset,
+                                  render_props.n_renders)
+        if render_props.noise_floor:
+            noise = bm.open_gramian(render_props.save_dir, gram.shape,
+                                    bm.noise_name)
+        else:
+            noise = None
+        if render_props.rig_xyz is not None:
+            n_cams = np.shape(render_props.rig_xyz)[1]
+            gram_cams = bm.open_gramian(render_props.save_dir,
+                                        (n_states, n_states, n_cams,
+                                         render_props.n_renders),
+                                        bm.rig_name)
+        else:
+            gram_cams = None
+        compute_gramian_object(render_props, gram, noise, gram_cams)
+        gram.flush()
+        if gram_cams is not None:
+            gram_cams.flush()
+
+        # report the size of the noise floor relative to the gramians
+        if noise is not None:
+            noise.flush()
+            rel_noise = np.linalg.norm(noise, axis=(0,1)) / \
+                        np.linalg.norm(gram, axis=(0,1))
+            print('gramian noise floor (relative, max over renders): %.3e'
+                  % np.amax(rel_noise))
@@ -0,0 +1,109 @@
+'''
+level of detail (lod) proxies of the models: copies of a model's .blend file
+in which the meshes of the object are decimated, for fast screening renders
+(e.g. coarse sweeps of views, whose finalists are rendered in full detail)
+
+level 0 is the model itself, and level n keeps about ratio**n of the faces of
+each mesh, proxies are built the first time they are used and are cached in
+dirs.blender_lod_dir, keyed by a hash of the model's .blend file, so they are
+rebuilt when the model changes
+
+this module must be imported inside of blender
+'''
+import os
+import glob
+import hashlib
+import bpy
+
+import pose_estimation.directories as dirs
+import pose_estimation.tools.timing as tt
+
+# fraction of the faces which each level keeps of the level before it
+ratio = 0.25
+
+# number of characters of the hash of the .blend file in proxy file names
+n_hash = 12
+
+
+def file_hash(filename):
+    '''
+    sha1 hash of the contents of a file, as hex
+    '''
+
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as input:
+        for chunk in iter(lambda: input.read(2**20), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+def proxy_file(model_name, level):
+    '''
+    file of the proxy of a model at a level of detail, for the current
+    contents of the model's .blend file
+    '''
+
+    blend_file = os.path.join(dirs.blender_models_dir, model_name + '.blend')
+    key = file_hash(blend_file)[:n_hash]
+
+    return os.path.join(dirs.blender_lod_dir,
+                        '%s_lod%d_%s.blend' % (model_name, level, key))
+
+
+def decimate_object(ob, ratio_ob):
+    '''
+    decimate the meshes of an object and all of its children (and their
+    children, ...), keeping about ratio_ob of the faces of each mesh, the
+    modifiers of each mesh are applied
+    '''
+
+    scene = bpy.context.scene
+    obs = [ob]
+    while obs:
+        ob_k = obs.pop()
+        obs.extend(ob_k.children)
+        if ob_k.type != 'MESH':
+            continue
+
+        decimate = ob_k.modifiers.new('lod_decimate', 'DECIMATE')
+        decimate.decimate_type = 'COLLAPSE'
+        decimate.ratio = ratio_ob
+        mesh = ob_k.to_mesh(scene, True, 'RENDER') # with modifiers applied
+        for mod in list(ob_k.modifiers):
+            ob_k.modifiers.remove(mod)
+        ob_k.data = mesh
+
+
+def open_model(model_name, level=0, ob_name='all_parts'):
+    '''
+    open the .blend file of a model at a level of detail, building and caching
+    its proxy if it does not exist yet (older proxies of the same model and
+    level are removed)
+    '''
+
+    blend_file = os.path.join(dirs.blender_models_dir, model_name + '.blend')
+    if level == 0:
+        bpy.ops.wm.open_mainfile(filepath=blend_file)
+        return
+
+    lod_file = proxy_file(model_name, level)
+    if os.path.isfile(lod_file):
+        bpy.ops.wm.open_mainfile(filepath=lod_file)
+        return
+
+    with tt.span('build_lod', model_name=model_name, level=level):
+        bpy.ops.wm.open_mainfile(filepath=blend_file)
+        decimate_object(bpy.data.objects[ob_name], ratio**level)
+
+        # save the proxy (as a copy, so the open file is still the model's)
+        if not os.path.isdir(dirs.blender_lod_dir):
+            os.makedirs(dirs.blender_lod_dir)
+        pattern = os.path.join(dirs.blender_lod_dir,
+                               '%s_lod%d_*.blend' % (model_name, level))
+        for old_file in glob.glob(pattern):
+            os.remove(old_file)
+        lod_file_tmp = os.path.join(dirs.blender_lod_dir, '.tmp_%d_%s'
+                                    % (os.getpid(), os.path.basename(lod_file)))
+        bpy.ops.wm.save_as_mainfile(filepath=lod_file_tmp, copy=True)
+        os.replace(lod_file_tmp, lod_file)
@@ -0,0 +1,187 @@
+'''
+a job is handed to blender as a manifest in the job directory: a small json
+file of metadata (manifest.json) plus one .npy file for each array attribute
+of the RenderProperties object
+
+blender reads the arrays as memory maps, so only the slices that are needed
+for each render are read from disk, and results are streamed into a
+preallocated .npy array (gramian.npy) which can also be memory mapped
+
+results can also be shared with the process which submitted the jobs: blender
+writes them into a memory-mapped array on a tmpfs (i.e. in shared memory)
+which that process created, and which it reads without loading or copying
+files (see create_shared_result())
+'''
+import os
+import json
+import tempfile
+import numpy as np
+
+import pose_estimation.tools.scratch as ts
+import pose_estimation.gramian.functions as gf
+from pose_estimation.blender.render_properties import RenderProperties
+
+# version of the manifest format, increment when the format changes
+version = 1
+
+# files in the job directory
+manifest_name = 'manifest.json'
+gramian_name = 'gramian.npy'
+noise_name = 'noise.npy' # noise floor of the gramian, if it is estimated
+rig_name = 'gramian_rig.npy' # gramian of each camera of a camera rig
+
+# attributes which are set inside of blender, and are not written
+skip_attrs = ['ob', 'cam_ob', 'rig_obs', 'bkgd_node', 'save_dir']
+
+
+def to_json(obj):
+    '''
+    convert numpy scalars and small arrays to objects json can serialize
+    '''
+
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError('%s is not JSON serializable' % type(obj).__name__)
+
+
+def write_manifest(render_props, job_dir):
+    '''
+    write a RenderProperties object to job_dir as a manifest
+    '''
+
+    attrs = {}
+    arrays = {}
+    for key, val in vars(render_props).items():
+        if key in skip_attrs:
+            continue
+
+        if isinstance(val, np.ndarray) and val.ndim > 0:
+            arrays[key] = key + '.npy'
+            np.save(os.path.join(job_dir, arrays[key]), val)
+        else:
+            attrs[key] = val
+
+    # write the json file last (and atomically), so blender never sees a
+    # manifest whose arrays have not been written yet
+    manifest = {'version': version, 'attrs': attrs, 'arrays': arrays}
+    manifest_file = os.path.join(job_dir, manifest_name)
+    manifest_file_tmp = manifest_file + '.tmp'
+    with open(manifest_file_tmp, 'w') as output:
+        json.dump(manifest, output, default=to_json, indent=1)
+    os.replace(manifest_file_tmp, manifest_file)
+
+
+def read_manifest(job_dir, mmap_mode='r'):
+    '''
+    read the manifest in job_dir and return a RenderProperties object, arrays
+    are memory mapped unless mmap_mode is None
+    '''
+
+    manifest_file = os.path.join(job_dir, manifest_name)
+    with open(manifest_file, 'r') as input:
+        manifest = json.load(input)
+
+    if manifest['version'] != version:
+        raise ValueError('manifest version %d is not supported (expected %d)'
+                         % (manifest['version'], version))
+
+    render_props = RenderProperties()
+    for key, val in manifest['attrs'].items():
+        setattr(render_props, key, val)
+    for key, val in manifest['arrays'].items():
+        array_file = os.path.join(job_dir, val)
+        setattr(render_props, key, np.load(array_file, mmap_mode=mmap_mode))
+
+    return render_props
+
+
+def has_manifest(job_dir):
+    '''
+    check if job_dir contains a manifest
+    '''
+
+    return os.path.isfile(os.path.join(job_dir, manifest_name))
+
+
+def open_gramian(job_dir, shape, name=gramian_name):
+    '''
+    create a preallocated (nan-filled) memory-mapped array for the Gramians of
+    a job (or for another output of the same size, e.g. noise_name), so they
+    can be written render-by-render
+    '''
+
+    gram_file = os.path.join(job_dir, name)
+    gram = np.lib.format.open_memmap(gram_file, mode='w+', dtype=np.float64,
+                                     shape=shape)
+    gram[...] = np.nan
+
+    return gram
+
+
+def load_gramian(job_dir, mmap_mode=None, name=gramian_name):
+    '''
+    load the Gramians of a job (or another output, e.g. noise_name), size
+    (n_states, n_states, n_renders)
+    '''
+
+    gram_file = os.path.join(job_dir, name)
+
+    return np.load(gram_file, mmap_mode=mmap_mode)
+
+
+def create_shared_result(shape, dtype=np.float64, root=None,
+                         prefix='result_'):
+    '''
+    create an array which blender writes the results of jobs into, and the
+    process which submitted the jobs reads them from, see
+    RenderProperties.result_file and RenderProperties.frame_file
+
+    the array is a memory-mapped .npy file on a tmpfs if there is one (so the
+    results are never written to disk, and are not copied), otherwise in the
+    system temp directory (or root, if it is given), which falls back to
+    files, it is filled with nan (or 0 for integer arrays)
+
+    outputs:
+        result_file: file of the array, which should be removed (with
+                     os.remove()) when the results have been read
+        result: memory-mapped array
+    '''
+
+    root = ts.scratch_root(root)
+    fd, result_file = tempfile.mkstemp(suffix='.npy', prefix=prefix,
+                                       dir=root)
+    os.close(fd)
+    result = np.lib.format.open_memmap(result_file, mode='w+', dtype=dtype,
+                                       shape=shape)
+    if np.issubdtype(result.dtype, np.floating):
+        result[...] = np.nan
+
+    return result_file, result
+
+
+def result_view(result_file, offset, n, axis=-1):
+    '''
+    the part of a shared result array (see create_shared_result()) which a job
+    writes its results into, i.e. indices offset, ..., offset + n - 1 along
+    axis, as a writable memory map
+    '''
+
+    result = np.load(result_file, mmap_mode='r+')
+    ind = [slice(None)]*result.ndim
+    ind[axis] = slice(offset, offset + n)
+
+    return result[tuple(ind)]
+
+
+def load_gramian_states(job_dir):
+    '''
+    indices of the states of the Gramians of a job (see
+    RenderProperties.states), which index the rows and columns of
+    load_gramian()
+    '''
+
+    manifest_file = os.path.join(job_dir, manifest_name)
+    with open(manifest_file, 'r') as input:
+        manifest = json.load(input)
+
+    return gf.gramian_states(manifest['attrs'].get('states'))
@@ -1,76 +1,112 @@
 '''
 this script is to be run as a blender command:
 
-blender --background --python script_name.py -- data_dir
+blender --background --python script_name.py -- data_dir [data_dir ...]
 
-data_dir: directory containing to_render.pkl, which should contain a
-          RenderProperties object
+data_dir: directory containing a job manifest (see
+          pose_estimation/blender/manifest.py), or a to_render.pkl file which
+          contains a pickled RenderProperties object, several data_dirs can be
+          given to render several jobs in one blender session
 
 in this package, this script is usually not called directly: it is called by
 pose_estimation/blender/render.py
 
 '''
-import bpy
-import os.path
+import os
 import sys
+import json
+import time
 import math
 import pickle
 import numpy as np
 import transforms3d as t3d
 
-import pose_estimation.directories as dirs
 import pose_estimation.blender.functions as bf
+import pose_estimation.blender.manifest as bm
+import pose_estimation.tools.timing as tt
+from pose_estimation.blender.scene import SceneManager
+from pose_estimation.blender.render_properties import RenderProperties
 
 # get arguments, see:
 # https://blender.stackexchange.com/questions/6817/how-to-pass-command-line-
 # arguments-to-a-blender-python-script
 argv = sys.argv
 argv = argv[argv.index("--") + 1:] # get all args after "--"
-data_dir = argv[0]
-
-# load data from pkl file
-to_render_pkl = os.path.join(data_dir, 'to_render.pkl')
-with open(to_render_pkl, 'rb') as input:
-    render_props = pickle.load(input)
-render_props.save_dir = data_dir
-
-# model info
-blender_models_dir = dirs.blender_models_dir
-blend_file = os.path.join(blender_models_dir, render_props.model_name+'.blend')
-bpy.ops.wm.open_mainfile(filepath=blend_file)
-ob_name = 'all_parts'
-ob = bpy.data.objects[ob_name]
-render_props.ob = ob
-
-# camera
-camera_name = 'cam0'
-cam = bpy.data.cameras.new(camera_name)  # create a new camera
-cam_ob = bpy.data.objects.new(camera_name, cam)  # create a new camera object
-bpy.context.scene.camera = cam_ob  # set the active camera
-bpy.data.objects[camera_name].location = render_props.cam_xyz
-cam_ob.rotation_mode = 'QUATERNION'
-bpy.data.objects[camera_name].rotation_quaternion = render_props.cam_quat
-render_props.cam_ob = cam_ob
-
-# lens and sensor
-bpy.data.cameras[camera_name].lens = render_props.lens
-bpy.data.cameras[camera_name].sensor_width = render_props.sensor_width
-bpy.data.cameras[camera_name].sensor_height = render_props.sensor_height
-
-# if using backgrounds, make sure alpha is True
-if render_props.bkgd_image_list is not None:
-    render_props.alpha = True
-
-# scene properties
-bpy.data.scenes['Scene'].render.resolution_x = render_props.pix_width
-bpy.data.scenes['Scene'].render.resolution_y = render_props.pix_height
-bpy.data.scenes['Scene'].render.resolution_percentage = 100
-bpy.data.scenes['Scene'].render.image_settings.file_format = 'PNG'
-bpy.data.scenes['Scene'].render.image_settings.color_mode = 'RGBA'
-bpy.data.scenes['Scene'].cycles.film_transparent = True
-bpy.data.scenes['Scene'].render.engine = 'CYCLES'
-#bpy.data.scenes['Scene'].render.engine = 'BLENDER_EEVEE'
-bpy.data.scenes['Scene'].cycles.device = 'GPU'
-
-# compute gramian
-bf.render_pose(render_props)
+data_dirs = argv
+
+# time at which blender was started (by pose_estimation/blender/render.py)
+t_script = time.time()
+t_start = float(os.environ.get('POSE_ESTIMATION_T0', t_script))
+
+# thread budget of this blender session (see
+# pose_estimation.blender.render.thread_budget()), if any
+if 'POSE_ESTIMATION_BUDGET' in os.environ:
+    budget = json.loads(os.environ['POSE_ESTIMATION_BUDGET'])
+else:
+    budget = {}
+
+
+def load_job(data_dir):
+    '''
+    load a RenderProperties object from the manifest in data_dir (arrays are
+    memory mapped), or from a pkl file
+
+    pkl files can be older than some attributes of RenderProperties, so the
+    attributes which are missing are set to their defaults
+    '''
+
+    if bm.has_manifest(data_dir):
+        render_props = bm.read_manifest(data_dir)
+    else:
+        to_render_pkl = os.path.join(data_dir, 'to_render.pkl')
+        with open(to_render_pkl, 'rb') as input:
+            render_props = pickle.load(input)
+        for key, val in vars(RenderProperties()).items():
+            if not hasattr(render_props, key):
+                setattr(render_props, key, val)
+    render_props.save_dir = data_dir
+
+    return render_props
+
+
+# load all jobs, and order them by model (and level of detail) so each .blend
+# file is only opened once
+jobs = [load_job(data_dir) for data_dir in data_dirs]
+jobs.sort(key=lambda render_props: (render_props.model_name,
+                                    render_props.lod))
+
+# render each job, the scene is kept between jobs and only what has changed is
+# updated
+scene_manager = SceneManager()
+for k, render_props in enumerate(jobs):
+
+    # trace the time spent in each stage of the job?
+    if render_props.trace:
+        trace_file = os.path.join(render_props.save_dir, 'trace.jsonl')
+        if render_props.cprofile:
+            profile_file = os.path.join(render_props.save_dir,
+                                        'profile.prof')
+        else:
+            profile_file = None
+        tt.tracer.enable(trace_file, profile_file)
+        if k == 0:
+            tt.tracer.add_span('blender_startup', t_start, t_script)
+
+    # jobs which do not set their threads and tile size use the budget's
+    for key in ['threads', 'tile_size']:
+        if getattr(render_props, key, None) is None:
+            setattr(render_props, key, budget.get(key))
+
+    # if using backgrounds, make sure alpha is True (the compositor puts the
+    # render over the background image where it is transparent)
+    if render_props.bkgd_image_list is not None:
+        render_props.alpha = True
+
+    # model, camera, and scene properties
+    with tt.span('scene_setup', model_name=render_props.model_name):
+        scene_manager.setup(render_props)
+
+    # render, and compute gramian
+    with tt.span('render_pose', n_renders=render_props.n_renders):
+        bf.render_pose(render_props)
+    tt.tracer.disable()
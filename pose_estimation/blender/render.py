@@ -1,18 +1,138 @@
+import os
+import json
+import time
 import pkgutil
+import resource
 import subprocess
 import pose_estimation.directories as dirs
+import pose_estimation.tools.timing as tt
 
 # get path to render script
 mod_name = 'pose_estimation.blender.process_renders'
 pkg = pkgutil.get_loader(mod_name)
 render_script = pkg.get_filename()
 
+# get path to symmetry detection script
+symmetry_script = pkgutil.get_loader(
+    'pose_estimation.blender.detect_symmetry').get_filename()
+
 # functions
-def blender_render(render_dir):
+def available_cpus():
+    '''
+    cpus which this process may run on
+    '''
+
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(os.cpu_count()))
+
+
+def thread_budget(n_workers, cpus=None, tile_size=32):
+    '''
+    split the cpus (by default, all available cpus) between n_workers
+    concurrent blender workers, so they do not oversubscribe the computer
+
+    output: list (of length n_workers) of budgets, which are dictionaries with
+        'threads': number of render threads of the worker
+        'cpus': cpus the worker is pinned to
+        'tile_size': render tile size (in pixels), small tiles keep all
+                     threads busy until the end of a render on cpus
+    '''
+
+    if cpus is None:
+        cpus = available_cpus()
+
+    # give each worker a contiguous group of cpus, if there are more workers
+    # than cpus, workers share cpus
+    budgets = []
+    for k in range(n_workers):
+        if n_workers <= len(cpus):
+            group = cpus[k*len(cpus)//n_workers:(k+1)*len(cpus)//n_workers]
+        else:
+            group = [cpus[k % len(cpus)]]
+        budgets.append({'threads': len(group), 'cpus': group,
+                        'tile_size': tile_size})
+
+    return budgets
+
+
+def blender_render(render_dir, timeout=None, budget=None):
     '''
     call a blender command which will generate renders in render_dir
+
+    render_dir can also be a list of directories, in which case all of the jobs
+    are rendered in one blender session (so blender is only started once, and
+    each model is only loaded once)
+
+    budget is a dictionary from thread_budget(), if it is given blender is
+    pinned to budget['cpus'], and jobs which do not set threads or tile_size
+    use the budget's
+
+    returns the subprocess.CompletedProcess of the blender command, whose
+    returncode is nonzero if the render script failed, with the wall and cpu
+    time of blender (in seconds) in its wall_time and cpu_time attributes, if
+    timeout (seconds) is given, subprocess.TimeoutExpired is raised if blender
+    takes longer
     '''
 
-    blender_cmd = 'blender --background --python ' + render_script + \
-                  ' -- ' + render_dir
-    subprocess.run([blender_cmd], shell=True)
+    if isinstance(render_dir, str):
+        render_dirs = [render_dir]
+    else:
+        render_dirs = list(render_dir)
+    if not render_dirs:
+        return None
+
+    # the start time is passed to blender, so it can trace its startup time
+    env = dict(os.environ)
+    env['POSE_ESTIMATION_T0'] = repr(time.time())
+    blender_cmd = ['blender', '--background', '--python-exit-code', '1',
+                   '--python', render_script, '--'] + render_dirs
+
+    # thread budget
+    preexec_fn = None
+    if budget is not None:
+        env['POSE_ESTIMATION_BUDGET'] = json.dumps(budget)
+        if budget.get('cpus') and hasattr(os, 'sched_setaffinity'):
+            cpus = budget['cpus']
+            preexec_fn = lambda: os.sched_setaffinity(0, cpus)
+
+    usage_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    t_start = time.time()
+    with tt.span('blender_render', n_jobs=len(render_dirs)):
+        proc = subprocess.run(blender_cmd, env=env, timeout=timeout,
+                              preexec_fn=preexec_fn)
+    usage_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+    proc.wall_time = time.time() - t_start
+    proc.cpu_time = (usage_end.ru_utime - usage_start.ru_utime) + \
+                    (usage_end.ru_stime - usage_start.ru_stime)
+
+    return proc
+
+
+def blender_detect_symmetry(model_names):
+    '''
+    call a blender command which detects the symmetry of each model of
+    model_names (of its mesh and the lamps of its scene), and caches it (see
+    pose_estimation.gramian.symmetry.model_symmetry())
+
+    returns the subprocess.CompletedProcess of the blender command
+    '''
+
+    blender_cmd = ['blender', '--background', '--python-exit-code', '1',
+                   '--python', symmetry_script, '--'] + list(model_names)
+
+    return subprocess.run(blender_cmd)
+
+
+def job_dir(save_dir, i):
+    '''
+    directory for the i'th job of a batch of jobs in save_dir, it is created if
+    it does not exist
+    '''
+
+    job_dir_i = os.path.join(save_dir, 'job_%06d' % i)
+    if not os.path.isdir(job_dir_i):
+        os.makedirs(job_dir_i)
+
+    return job_dir_i
@@ -17,29 +17,132 @@ class RenderProperties:
 
         # object
         self.ob = None # this will be set inside of Blender
+
+        # level of detail of the model, 0 is the model itself, and level n is
+        # a decimated proxy of it with about 0.25**n of its faces, for fast
+        # screening renders (see pose_estimation/blender/lod.py)
+        self.lod = 0
         self.n_renders = 1
         self.xyz = np.array([[0],[0],[0]]) # size (3, n_renders)
         self.quat = np.array([[1],[0],[0],[0]]) # size (4, n_renders)
 
         # list of images (of length n_renders) for the render to be
-        # superimposed upon, None if it is not superimposed
+        # superimposed upon, None if it is not superimposed, the render is
+        # superimposed by blender's compositor
         self.bkgd_image_list = None
+        self.bkgd_node = None # this will be set inside of Blender
 
         # world lighting, size (3, n_renders)
         self.world_RGB = None  
 
-        # transparent background?
+        # transparent background? either a single bool for all renders, or a
+        # list of bools of length n_renders
         self.alpha = True 
 
+        # write the renders and their pose labels to sharded tar files in
+        # save_dir (see pose_estimation/tools/dataset.py), with shard_size
+        # renders per shard, which are encoded by dataset_processes worker
+        # processes, instead of one png per render? (for large training sets)
+        self.dataset = False
+        self.shard_size = 1000
+        self.dataset_processes = 4
+
         # gramian
         self.compute_gramian = False
         self.eps = 1e-2
 
+        # states (indices into x, y, z, x-rot, y-rot, z-rot) whose
+        # perturbations are rendered, e.g. [0, 1, 2] for translations only,
+        # the gramian is the gramian of these states (in increasing order, see
+        # pose_estimation.gramian.functions.gramian_states()), if None all
+        # states are used
+        self.states = None
+
+        # compute differences of perturbed images as integers (not used with
+        # OPEN_EXR perturbation images)
+        self.int_diff = True
+
+        # file format of the perturbation images of the gramian, 'PNG' (8-bit
+        # sRGB) or 'OPEN_EXR' (uncompressed 32-bit float, linear), OPEN_EXR
+        # avoids quantization and compression (renders which are saved are
+        # always PNG), gramians of OPEN_EXR images are of linear pixel values,
+        # so they have a different scale from gramians of PNG images (and are
+        # not comparable to them)
+        self.gramian_format = 'PNG'
+
+        # only render the region of the image which contains the object (under
+        # all perturbations) when computing the gramian, padded by roi_pad
+        # pixels (only used when background images are not used), the region
+        # is found from the object's bounding boxes, so shadows and
+        # reflections outside of it are left out of the gramian (increase
+        # roi_pad for scenes where they matter)
+        self.roi = False
+        self.roi_pad = 4
+
+        # store the perturbation image differences sparsely, i.e. only the
+        # pixels which change, and save them to deltas_000000.npz, ... for
+        # later analysis?
+        self.sparse_diff = False
+        self.save_deltas = False
+
+        # perturbation images are loaded and compared, and the gramians are
+        # computed, by gramian_processes worker processes while blender
+        # renders the next images, and at most gramian_pending renders wait
+        # for their gramians to be computed
+        self.gramian_processes = 2
+        self.gramian_pending = 2
+
+        # results which are shared with the process which submitted the job
+        # (see pose_estimation.blender.manifest.create_shared_result()),
+        # instead of files in save_dir: if result_file is not None, the
+        # gramians are written to result_file[:,:,k] instead of gramian.npy,
+        # and if frame_file is not None, the renders are written to
+        # frame_file[k] (uint8 RGBA, size (n, pix_height, pix_width, 4))
+        # instead of pngs, for k = result_offset, ...,
+        # result_offset + n_renders - 1
+        self.result_file = None
+        self.frame_file = None
+        self.result_offset = 0
+
+        # write the time spent in each stage of the job to trace.jsonl in
+        # save_dir (see pose_estimation/tools/timing.py), and also save
+        # cProfile stats to profile.prof?
+        self.trace = False
+        self.cprofile = False
+
         # perturbations, if None, use initial perturbation
         # order of perturbations: -1, +1, -2, +2, ...
         self.pert_xyz = None # size (3, 12, n_renders)
         self.pert_quat = None # size (4, 12, n_renders)
 
+        # number of Cycles samples per pixel, if None use the number of
+        # samples of the .blend file
+        self.samples = None
+
+        # Cycles sampling seed, which is the same for every render, so the
+        # sampling noise of perturbation images is (mostly) the same and
+        # cancels in their differences, if None use the seed of the .blend file
+        self.seed = 0
+
+        # estimate the noise floor of the gramian by rendering each pair of
+        # perturbations again with a different seed, and save it to noise.npy
+        # in save_dir? (this doubles the number of perturbation renders)
+        self.noise_floor = False
+
+        # keep render data (e.g. compiled shaders, and image textures)
+        # between renders, so renders which only move the object or camera do
+        # not sync it again (cycles in blender 2.79 still rebuilds the BVH
+        # when an object moves, see the no_persistent_data configuration of
+        # pose_estimation/gramian/fast_modes.py for the measured gain)
+        self.persistent_data = True
+
+        # number of render threads, and render tile size (in pixels), if None
+        # use the thread budget of the worker (see
+        # pose_estimation.blender.render.thread_budget()), or if there is none
+        # the settings of the .blend file
+        self.threads = None
+        self.tile_size = None
+
         # camera
         # default based on properties I think a Canon Powershot A2500 has
         self.cam_ob = None # this will be set inside of Blender
@@ -52,3 +155,13 @@ class RenderProperties:
         self.lens = 9
         self.sensor_width = 6.2
         self.sensor_height = 4.6
+
+        # camera rig, if not None the gramian is computed from the images of
+        # several cameras (with the same lens and sensor as the camera), and
+        # is the sum of the gramians of the cameras, which are saved to
+        # gramian_rig.npy in save_dir
+        # positions and quaternions of the cameras relative to the camera
+        # (cam_xyz, cam_quat), size (3, n_cams) and (4, n_cams)
+        self.rig_xyz = None
+        self.rig_quat = None
+        self.rig_obs = None # this will be set inside of Blender
@@ -0,0 +1,290 @@
+'''
+keep the scene of a blender session (model, camera, and render settings)
+resident between jobs, so that jobs which use the same model do not reload the
+.blend file, recreate the camera, or reapply settings which have not changed
+
+this module must be imported inside of blender
+'''
+import bpy
+import numpy as np
+
+import pose_estimation.tools.timing as tt
+import pose_estimation.blender.lod as bl
+
+# names of the object and camera in the scene
+ob_name = 'all_parts'
+camera_name = 'cam0'
+
+# name of the image which background images are loaded into, and prefix of the
+# names of the compositor nodes which superimpose renders on it
+bkgd_image_name = 'bkgd_image'
+bkgd_node_prefix = 'bkgd_'
+
+
+class SceneManager:
+
+    def __init__(self):
+        self.model_name = None # name of the .blend file which is open
+        self.lod = 0 # its level of detail (see pose_estimation/blender/lod.py)
+        self.ob = None
+        self.cam_ob = None
+        self.rig_obs = [] # cameras of a camera rig
+        self.bkgd_node = None # image node of the background compositor
+        self.world_RGBA = None # world color when the .blend file was opened
+        self.settings = {} # settings which have been applied, by key
+        self.defaults = {} # values of settings in the .blend file, by key
+
+    def load_model(self, model_name, lod=0):
+        '''
+        open the .blend file of a model at a level of detail (see
+        pose_estimation/blender/lod.py), unless it is already open, and return
+        its object
+        '''
+
+        if model_name == self.model_name and lod == self.lod:
+            return self.ob
+
+        with tt.span('open_mainfile', model_name=model_name, lod=lod):
+            bl.open_model(model_name, lod, ob_name)
+
+        # opening a file replaces all blender data, so forget everything
+        self.model_name = model_name
+        self.lod = lod
+        self.ob = bpy.data.objects[ob_name]
+        self.cam_ob = None
+        self.rig_obs = []
+        self.bkgd_node = None
+        self.settings = {}
+        self.defaults = {}
+        world_bkgd = self.world_background()
+        if world_bkgd is not None:
+            self.world_RGBA = tuple(world_bkgd.default_value)
+        else:
+            self.world_RGBA = None
+
+        return self.ob
+
+    def camera(self):
+        '''
+        get the camera object, creating it (and making it the active camera)
+        if it does not exist yet
+        '''
+
+        if self.cam_ob is None:
+            cam = bpy.data.cameras.new(camera_name) # create a new camera
+            self.cam_ob = bpy.data.objects.new(camera_name, cam)
+            self.cam_ob.rotation_mode = 'QUATERNION'
+            bpy.context.scene.camera = self.cam_ob # set the active camera
+
+        return self.cam_ob
+
+    def rig_cameras(self, n_cams):
+        '''
+        get n_cams camera objects for a camera rig, creating them if they do
+        not exist yet, they share the camera data (lens and sensor) of the
+        camera
+        '''
+
+        cam = self.camera().data
+        while len(self.rig_obs) < n_cams:
+            name = '%s_rig_%d' % (camera_name, len(self.rig_obs))
+            rig_ob = bpy.data.objects.new(name, cam)
+            rig_ob.rotation_mode = 'QUATERNION'
+            self.rig_obs.append(rig_ob)
+
+        return self.rig_obs[:n_cams]
+
+    def background_compositor(self):
+        '''
+        get the image node of the compositor which superimposes renders on a
+        background image, creating the compositor nodes if they do not exist
+        yet (the scene must use nodes, the background image is set by
+        pose_estimation.blender.functions.set_background())
+
+        the render (which has a transparent background) is put over the image,
+        which is scaled to the size of the render, so the image which is saved
+        is already superimposed, the nodes replace the input of the composite
+        node (the .blend files of the models do not use the compositor)
+        '''
+
+        if self.bkgd_node is not None:
+            return self.bkgd_node
+
+        # the node tree is created when the scene first uses nodes
+        tree = bpy.data.scenes['Scene'].node_tree
+        nodes = tree.nodes
+
+        # render layers and composite nodes
+        layers = None
+        composite = None
+        for node in nodes:
+            if node.type == 'R_LAYERS' and layers is None:
+                layers = node
+            elif node.type == 'COMPOSITE' and composite is None:
+                composite = node
+        if layers is None:
+            layers = nodes.new('CompositorNodeRLayers')
+        if composite is None:
+            composite = nodes.new('CompositorNodeComposite')
+
+        # background image, which is loaded from a file
+        image = bpy.data.images.get(bkgd_image_name)
+        if image is None:
+            image = bpy.data.images.new(bkgd_image_name, 1, 1)
+            image.source = 'FILE'
+        image_node = nodes.new('CompositorNodeImage')
+        image_node.name = bkgd_node_prefix + 'image'
+        image_node.image = image
+
+        # scale the background image to the size of the render
+        scale = nodes.new('CompositorNodeScale')
+        scale.name = bkgd_node_prefix + 'scale'
+        scale.space = 'RENDER_SIZE'
+        scale.frame_method = 'STRETCH'
+
+        # render over background image, renders are premultiplied
+        alpha_over = nodes.new('CompositorNodeAlphaOver')
+        alpha_over.name = bkgd_node_prefix + 'alpha_over'
+        alpha_over.use_premultiply = False
+
+        tree.links.new(image_node.outputs['Image'], scale.inputs['Image'])
+        tree.links.new(scale.outputs['Image'], alpha_over.inputs[1])
+        tree.links.new(layers.outputs['Image'], alpha_over.inputs[2])
+        tree.links.new(alpha_over.outputs['Image'], composite.inputs['Image'])
+
+        self.bkgd_node = image_node
+
+        return self.bkgd_node
+
+    def world_background(self):
+        '''
+        input of the world's background node which sets the world color, or
+        None if the world does not have one
+        '''
+
+        world = bpy.data.worlds.get('World')
+        if world is None or world.node_tree is None:
+            return None
+        bkgd = world.node_tree.nodes.get('Background')
+        if bkgd is None:
+            return None
+
+        return bkgd.inputs[0]
+
+    def set(self, key, owner, attr, value):
+        '''
+        set owner.attr = value, unless it has already been set to value by
+        this scene manager, key is a unique name for the setting
+
+        if value is None, the setting is restored to its value in the .blend
+        file
+        '''
+
+        if value is None:
+            if key not in self.defaults:
+                return # never changed
+            value = self.defaults[key]
+
+        if self.settings.get(key) == value:
+            return
+
+        if key not in self.defaults:
+            self.defaults[key] = getattr(owner, attr)
+        setattr(owner, attr, value)
+        self.settings[key] = value
+
+    def setup(self, render_props):
+        '''
+        set up the scene for a job, and set render_props.ob and
+        render_props.cam_ob
+        '''
+
+        scene = bpy.data.scenes['Scene']
+
+        # model and camera
+        render_props.ob = self.load_model(render_props.model_name,
+                                          int(render_props.lod))
+        render_props.cam_ob = self.camera()
+        render_props.cam_ob.location = render_props.cam_xyz
+        render_props.cam_ob.rotation_quaternion = render_props.cam_quat
+        bpy.context.scene.camera = render_props.cam_ob
+        if render_props.rig_xyz is not None:
+            render_props.rig_obs = self.rig_cameras(
+                np.shape(render_props.rig_xyz)[1])
+
+        # background images are superimposed by the compositor, which is
+        # turned off (unless the .blend file uses it) when there are none
+        if render_props.bkgd_image_list is not None:
+            self.set('use_nodes', scene, 'use_nodes', True)
+            self.set('use_compositing', scene.render, 'use_compositing', True)
+            render_props.bkgd_node = self.background_compositor()
+        else:
+            self.set('use_nodes', scene, 'use_nodes', None)
+            self.set('use_compositing', scene.render, 'use_compositing', None)
+
+        # lens and sensor
+        cam = render_props.cam_ob.data
+        self.set('lens', cam, 'lens', float(render_props.lens))
+        self.set('sensor_width', cam, 'sensor_width',
+                 float(render_props.sensor_width))
+        self.set('sensor_height', cam, 'sensor_height',
+                 float(render_props.sensor_height))
+
+        # the world color is changed by renders which set world_RGB, so always
+        # restore it to the color of the .blend file
+        if self.world_RGBA is not None:
+            self.world_background().default_value = self.world_RGBA
+
+        # scene properties
+        self.set('resolution_x', scene.render, 'resolution_x',
+                 int(render_props.pix_width))
+        self.set('resolution_y', scene.render, 'resolution_y',
+                 int(render_props.pix_height))
+        self.set('resolution_percentage', scene.render,
+                 'resolution_percentage', 100)
+        self.set('file_format', scene.render.image_settings, 'file_format',
+                 'PNG')
+        self.set('engine', scene.render, 'engine', 'CYCLES')
+        #self.set('engine', scene.render, 'engine', 'BLENDER_EEVEE')
+        self.set('device', scene.cycles, 'device', 'GPU')
+        if render_props.samples is None:
+            self.set('samples', scene.cycles, 'samples', None)
+        else:
+            self.set('samples', scene.cycles, 'samples',
+                     int(render_props.samples))
+
+        # render data which is kept between renders
+        self.set('use_persistent_data', scene.render, 'use_persistent_data',
+                 bool(render_props.persistent_data))
+
+        # sampling seed, which must not change from frame to frame
+        if render_props.seed is None:
+            self.set('seed', scene.cycles, 'seed', None)
+            self.set('use_animated_seed', scene.cycles, 'use_animated_seed',
+                     None)
+        else:
+            self.set('seed', scene.cycles, 'seed', int(render_props.seed))
+            self.set('use_animated_seed', scene.cycles, 'use_animated_seed',
+                     False)
+
+        # threads and tile size
+        if render_props.threads is None:
+            self.set('threads_mode', scene.render, 'threads_mode', None)
+            self.set('threads', scene.render, 'threads', None)
+        else:
+            self.set('threads_mode', scene.render, 'threads_mode', 'FIXED')
+            self.set('threads', scene.render, 'threads',
+                     int(render_props.threads))
+        if render_props.tile_size is None:
+            self.set('tile_x', scene.render, 'tile_x', None)
+            self.set('tile_y', scene.render, 'tile_y', None)
+        else:
+            self.set('tile_x', scene.render, 'tile_x',
+                     int(render_props.tile_size))
+            self.set('tile_y', scene.render, 'tile_y',
+                     int(render_props.tile_size))
+
+        # color mode and transparency are set for every render, see
+        # pose_estimation.blender.functions.render_image()
+        scene.render.image_settings.color_mode = 'RGBA'
+        scene.cycles.film_transparent = True
@@ -5,10 +5,15 @@ they should be changed by each user
 
 # blender
 blender_models_dir = '/home/trevor/ACC_2019_Avant/blender_models/'
+# decimated (level of detail) copies of the models, see
+# pose_estimation/blender/lod.py
+blender_lod_dir = '/home/trevor/ACC_2019_Avant/blender_models/lod/'
 
 # gramian
-# ramdisk must first be created!!!
-gramian_image_save_dir =  '/mnt/ramdisk/gramian/'
+# scratch directory for gramian perturbation images, each job creates (and
+# removes) its own subdirectory of it, if None a tmpfs (e.g. /dev/shm) is found
+# automatically
+gramian_image_save_dir =  None
 visualize_gram_dir =      '/home/trevor/large_files/se3/gramian/'
 visualize_gram_pred_dir = '/home/trevor/large_files/se3/gramian_pred/'
 visualize_gram_test_dir = '/home/trevor/large_files/se3/gramian_test/'
@@ -17,3 +22,4 @@ gram_eps_dir =            '/home/trevor/large_files/se3/epsilon/'
 best_views_dir =          '/home/trevor/large_files/se3/best_views/'
 trajectories_dir =        '/home/trevor/large_files/se3/trajectories/'
 dynamic_dir =             '/home/trevor/large_files/se3/dynamic/'
+fast_modes_dir =          '/home/trevor/large_files/se3/fast_modes/'
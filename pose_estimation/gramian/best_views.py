@@ -1,14 +1,16 @@
 import os.path
+import sys
 import math
-import pickle
 import shutil
 import numpy as np
-import transforms3d as t3d
 
 import pose_estimation.directories as dirs
 import pose_estimation.blender.render as br
+import pose_estimation.blender.manifest as bm
 import pose_estimation.tools.math as tm
 import pose_estimation.gramian.functions as gf
+import pose_estimation.gramian.symmetry as gs
+from pose_estimation.gramian.checkpoint import GramianCheckpoint
 from pose_estimation.blender.render_properties import RenderProperties
 
 # model info
@@ -18,6 +20,11 @@ name = 'chair'
 # save directory
 save_dir = dirs.best_views_dir
 
+# only render one of each set of views which are related by a symmetry of the
+# model? (the symmetry of the model and the lamps of its scene is detected in
+# blender the first time, see pose_estimation/gramian/symmetry.py)
+use_symmetry = False
+
 # sample azimuthal and elevation angles, and calculate the Gramian for each
 # sample
 n_ang_azi = 20
@@ -36,25 +43,49 @@ elif name == 'car':
 xyz = np.array([[0], [0], [0]]) 
 quat = np.array([[1], [0], [0], [0]]) 
 cam_xyz_dft = rad*np.array([[0], [-1], [0]]) # camera xyz default
-cam_R_dft = t3d.euler.euler2mat(math.pi/2, 0, 0, 'sxyz')
+cam_R_dft = tm.euler2mat(math.pi/2, 0, 0, 'sxyz')
+
+# camera poses of all azimuthal and elevation angles, index ij = i*n_ang_ele + j
+# is azimuthal angle i and elevation angle j
+ang_azi_all = np.repeat(ang_azi, n_ang_ele)
+ang_ele_all = np.tile(ang_ele, n_ang_azi)
+R_all = tm.R_z(ang_azi_all) @ tm.R_x(-ang_ele_all) # size (n_renders, 3, 3)
+cam_xyz_all = (R_all @ cam_xyz_dft)[:,:,0].T
+cam_quat_all = tm.mat2quat(R_all @ cam_R_dft)
+
+# if the model is symmetric, only render the camera poses which are not
+# related to another camera pose by a symmetry, src[ij] is the pose which is
+# rendered for pose ij (see pose_estimation/gramian/symmetry.py)
+if use_symmetry:
+    sym = gs.model_symmetry(name)
+else:
+    sym = None
+src, T = gs.reduce_sweep(sym, np.tile(xyz, n_renders),
+                         np.tile(quat, n_renders), cam_xyz_all, cam_quat_all)
+
+# loop over azimuthal and elevation angles and render
+# Gramians are checkpointed, so if the sweep is interrupted, running this
+# script again skips the Gramians which have already been computed
+ckpt = GramianCheckpoint(save_dir, n_renders, name='best_views_' + name)
+for i in range(n_ang_azi):
+    job_dirs = [] # one job per elevation angle, all rendered together
+    job_inds = []
 
-# loop over azimuthal and elevation angles and generate quaternions
-gram = np.full((6,6,n_renders), np.nan) # to be filled
-for i, ang_azi_i in enumerate(ang_azi):
-    R_z_i = tm.R_z(ang_azi_i)
+    # the jobs write their gramians into a shared array (in memory, if
+    # possible), gram_share[:,:,k] is the gramian of job k
+    share_file, gram_share = bm.create_shared_result((6, 6, n_ang_ele))
 
-    for j, ang_ele_j in enumerate(ang_ele):
+    for j in range(n_ang_ele):
         ij = i*n_ang_ele + j
-        R_x_j = tm.R_x(-ang_ele_j)
-        R_ij = R_z_i @ R_x_j
-        cam_xyz = R_ij @ cam_xyz_dft
-        cam_quat = t3d.quaternions.mat2quat(R_ij @ cam_R_dft)
+        if ckpt.is_done(ij) or src[ij] != ij:
+            continue
+        cam_xyz = cam_xyz_all[:,[ij]]
+        cam_quat = cam_quat_all[:,ij]
 
-        # render
-        to_render_pkl = os.path.join(save_dir, 'to_render.pkl')
+        # render properties object
         render_props = RenderProperties()
         render_props.model_name = name
-        render_props.image_names = ['%06d.png' % ij]
+        render_props.image_names = [os.path.join(save_dir, '%06d.png' % ij)]
         render_props.n_renders = 1
         render_props.xyz = xyz
         render_props.quat = quat
@@ -62,17 +93,43 @@ for i, ang_azi_i in enumerate(ang_azi):
         render_props.cam_quat = cam_quat
         render_props.compute_gramian = True
         render_props.alpha = False
-        with open(to_render_pkl, 'wb') as output:
-            pickle.dump(render_props, output, pickle.HIGHEST_PROTOCOL)
-        br.blender_render(save_dir)
+        render_props.result_file = share_file
+        render_props.result_offset = len(job_inds)
+        job_dir_j = br.job_dir(save_dir, j)
+        bm.write_manifest(render_props, job_dir_j)
+        job_dirs.append(job_dir_j)
+        job_inds.append(ij)
 
-        # load gramian
-        gram_npz = os.path.join(save_dir, 'gramian.npz')
-        gram_data = np.load(gram_npz)
-        gram_ij = gram_data['gram']
-        gram[:,:,ij] = np.squeeze(gram_ij)
+    # render all elevation angles in one blender session, and read gramians,
+    # gramians of a failed blender session (or which were not written) are
+    # not marked as done, so they are computed again when this is run again
+    proc = br.blender_render(job_dirs)
+    if proc is not None and proc.returncode != 0:
+        print('blender failed for azimuth %d, its gramians will be retried'
+              % i)
+    elif proc is not None:
+        for k, ij in enumerate(job_inds):
+            if not np.isnan(gram_share[:,:,k]).any():
+                ckpt.write(ij, gram_share[:,:,k])
+    del gram_share
+    os.remove(share_file)
+
+# Gramians of the poses which were not rendered, from the poses related to them
+# by a symmetry
+for ij in ckpt.todo():
+    if ckpt.is_done(src[ij]):
+        ckpt.write(ij, gs.transform_gramian(ckpt.gram_data[src[ij]],
+                                            T[:,:,ij]))
+
+# the measures need every gramian, stop if a blender session failed
+missing = ckpt.todo()
+if missing.size:
+    print('the gramians of poses %s are missing, run this script again to '
+          'render them' % missing.tolist())
+    sys.exit(1)
 
 # measure the gramian
+gram = ckpt.gram()
 grm = gf.gramian_measures(gram)
 # get max and min, put each into a dictionary
 min_max_dict = {'index of min det': np.argmin(grm['det']),
@@ -84,6 +141,27 @@ min_max_dict = {'index of min det': np.argmin(grm['det']),
                 'index of min condition num': np.argmin(grm['cond_num']),
                 'index of max condition num': np.argmax(grm['cond_num'])} 
 
+# render the poses which were not rendered because they are related to
+# another pose by a symmetry (their images are not copies of that pose's
+# image, e.g. they are mirrored, or lit from another side)
+job_dirs = []
+for k, ij in enumerate(sorted(set(min_max_dict.values()))):
+    if src[ij] == ij:
+        continue
+    render_props = RenderProperties()
+    render_props.model_name = name
+    render_props.image_names = [os.path.join(save_dir, '%06d.png' % ij)]
+    render_props.n_renders = 1
+    render_props.xyz = xyz
+    render_props.quat = quat
+    render_props.cam_xyz = cam_xyz_all[:,[ij]]
+    render_props.cam_quat = cam_quat_all[:,ij]
+    render_props.alpha = False
+    job_dir_k = br.job_dir(save_dir, k)
+    bm.write_manifest(render_props, job_dir_k)
+    job_dirs.append(job_dir_k)
+br.blender_render(job_dirs)
+
 # copy renders to files with descriptive names
 for key, value in min_max_dict.items():
     print(key, ': ', value)
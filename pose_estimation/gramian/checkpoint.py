@@ -0,0 +1,76 @@
+'''
+checkpointing of Gramian sweeps, so a sweep which is interrupted (e.g. blender
+crashes or the computer is shut down) can be restarted without recomputing the
+Gramians which have already been computed
+'''
+import os
+import numpy as np
+
+
+class GramianCheckpoint:
+    '''
+    memory-mapped Gramians of a sweep, plus a completion bitmap which says
+    which Gramians have been computed
+
+    files in save_dir:
+        name_gram.npy: Gramians, size (n_gram, n_states, n_states)
+        name_done.npy: completion bitmap, size (n_gram)
+
+    if the files already exist (i.e. the sweep is being restarted), they are
+    opened and the completed Gramians are kept
+    '''
+
+    def __init__(self, save_dir, n_gram, n_states=6, name='sweep'):
+        self.gram_file = os.path.join(save_dir, name + '_gram.npy')
+        self.done_file = os.path.join(save_dir, name + '_done.npy')
+        shape = (n_gram, n_states, n_states)
+
+        if os.path.isfile(self.gram_file) and os.path.isfile(self.done_file):
+            self.gram_data = np.load(self.gram_file, mmap_mode='r+')
+            self.done = np.load(self.done_file, mmap_mode='r+')
+            if self.gram_data.shape != shape or self.done.shape != (n_gram,):
+                raise ValueError('checkpoint ' + self.gram_file + ' has '
+                                 'size ' + str(self.gram_data.shape) + ', '
+                                 'expected ' + str(shape))
+        else:
+            self.gram_data = np.lib.format.open_memmap(
+                self.gram_file, mode='w+', dtype=np.float64, shape=shape)
+            self.gram_data[...] = np.nan
+            self.gram_data.flush()
+            self.done = np.lib.format.open_memmap(
+                self.done_file, mode='w+', dtype=np.bool_, shape=(n_gram,))
+            self.done.flush()
+
+    def todo(self):
+        '''
+        indices of the Gramians which have not been computed yet
+        '''
+
+        return np.flatnonzero(~self.done)
+
+    def is_done(self, i):
+        '''
+        check if the i'th Gramian has been computed
+        '''
+
+        return bool(self.done[i])
+
+    def write(self, i, gram_i):
+        '''
+        write the i'th Gramian, the Gramian is flushed to disk before it is
+        marked as done, so an interruption never leaves a Gramian marked as
+        done without it having been written
+        '''
+
+        self.gram_data[i] = gram_i
+        self.gram_data.flush()
+        self.done[i] = True
+        self.done.flush()
+
+    def gram(self):
+        '''
+        all Gramians, size (n_states, n_states, n_gram), Gramians which have
+        not been computed are nan
+        '''
+
+        return np.moveaxis(np.array(self.gram_data), 0, 2)
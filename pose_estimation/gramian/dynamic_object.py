@@ -1,6 +1,5 @@
 import os
 import math
-import pickle
 import numpy as np
 import matplotlib.pyplot as mp
 import transforms3d as t3d
@@ -10,6 +9,7 @@ import pose_estimation.directories as dirs
 import pose_estimation.tools.math as tm
 import pose_estimation.tools.image as ti
 import pose_estimation.blender.render as br
+import pose_estimation.blender.manifest as bm
 import pose_estimation.gramian.functions as gf
 import pose_estimation.gramian.rigid_body as gr
 from pose_estimation.blender.render_properties import RenderProperties
@@ -61,7 +61,6 @@ inds_frame = inds[::step_frame] # gives n_frame + 1 indices
 inds_frame = inds_frame[:-1] # remove last index
 delta_t_frame = t[inds_frame[1]] - t[inds_frame[0]]
 save_dir = dirs.dynamic_dir
-to_render_pkl = os.path.join(save_dir, 'to_render.pkl')
 render_props = RenderProperties()
 render_props.n_renders = n_frame
 render_props.model_name = name
@@ -72,48 +71,40 @@ render_props.compute_gramian = True
 #render_props.compute_gramian = False
 render_props.pert_xyz = xyz_pert[:,:,inds_frame]
 render_props.pert_quat = q_pert[:,:,inds_frame]
-with open(to_render_pkl, 'wb') as output:
-    pickle.dump(render_props, output, pickle.HIGHEST_PROTOCOL)
+bm.write_manifest(render_props, save_dir)
 br.blender_render(save_dir)
 
 # gramian
-data = np.load(os.path.join(save_dir, 'gramian.npz'))
-gram = data['gram']
+gram = bm.load_gramian(save_dir)
 gram_sum = np.sum(gram, axis=2)
 gram_sum = delta_t_frame*gram_sum
 
-# render snapshots
+# render snapshots, all in one blender session
 n_snapshot = 14 # number of snapshots for figure
 step_snapshot = int(np.floor(n_t/n_snapshot))
 inds_snapshot = inds[::step_snapshot]
 inds_snapshot = inds_snapshot[:-1]
 png_name_snapshot = 'snapshot_%06d'
-for i in range(n_snapshot):
-    ind_i = inds_snapshot[i]
-    render_props = RenderProperties()
-    render_props.model_name = name
-    render_props.image_names = [png_name_snapshot % ind_i]
-    render_props.xyz = xyz[:,[ind_i]]
-    render_props.quat = q[:,[ind_i]]
-
-    # only make last snapshot have a background
-    if i < n_snapshot-1:
-        render_props.alpha = True
-    else:
-        render_props.alpha = False
-
-    with open(to_render_pkl, 'wb') as output:
-        pickle.dump(render_props, output, pickle.HIGHEST_PROTOCOL)
-    br.blender_render(save_dir)
+render_props = RenderProperties()
+render_props.model_name = name
+render_props.n_renders = n_snapshot
+render_props.image_names = [png_name_snapshot % i for i in inds_snapshot]
+render_props.xyz = xyz[:,inds_snapshot]
+render_props.quat = q[:,inds_snapshot]
+# only make last snapshot have a background
+render_props.alpha = [True]*(n_snapshot-1) + [False]
+bm.write_manifest(render_props, save_dir)
+br.blender_render(save_dir)
 
-# overlay snapshots
+# overlay snapshots, the last snapshot is in the back and the first is in the
+# front
 im_file_0 = os.path.join(save_dir,
                          png_name_snapshot % inds_snapshot[-1] + '.png')
-im_snapshot = ti.load_im_np(im_file_0)
-for i in reversed(inds_snapshot[:-1]):
-    im_file_i = os.path.join(save_dir, png_name_snapshot % i + '.png')
-    im_overlay = ti.load_im_np(im_file_i)
-    im_snapshot = ti.overlay(im_overlay, im_snapshot)
+im_bkgd = ti.load_im_np(im_file_0)
+im_overlays = np.stack([
+    ti.load_im_np(os.path.join(save_dir, png_name_snapshot % i + '.png'))
+    for i in reversed(inds_snapshot[:-1])])
+im_snapshot = ti.overlay_stack(im_overlays, im_bkgd)
 ti.write_im_np(os.path.join(save_dir, 'snapshots.png'), im_snapshot)
 print(gram_sum)
 tm.print_matrix_as_latex(gram_sum, n_digs=2)
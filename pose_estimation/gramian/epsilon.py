@@ -3,7 +3,6 @@ calculate empirical observability Gramian with different epsilon values
 '''
 import os
 import math
-import pickle
 import numpy as np
 import transforms3d as t3d
 import matplotlib.pyplot as plt
@@ -11,11 +10,11 @@ import matplotlib.pyplot as plt
 import pose_estimation.directories as dirs
 import pose_estimation.tools.image as ti
 import pose_estimation.blender.render as br
+import pose_estimation.blender.manifest as bm
 from pose_estimation.blender.render_properties import RenderProperties
 
 # files
 save_dir = dirs.gram_eps_dir
-gram_npz = os.path.join(save_dir, 'gramian.npz')
 gram_eps_npz = os.path.join(save_dir, 'gram_eps.npz')
 
 # model info
@@ -33,12 +32,18 @@ quat = quat[:, np.newaxis] # make it a column vector
 n_eps = 30
 eps = np.logspace(-7, 1, num=n_eps, base=10)
 
+# also estimate and plot the noise floor of each Gramian? (all renders use the
+# same sampling seed, so sampling noise mostly cancels in the differences of
+# perturbation images, the noise floor is what is left of it, this doubles the
+# number of perturbation renders, and the figure of the paper does not have it)
+use_noise_floor = False
+
 # iterate over epsilons and calculate Gramian
 gram = np.full((6, 6, n_eps), np.nan)
+noise = np.full((6, 6, n_eps), np.nan)
 for i in range(n_eps):
 
     # render
-    to_render_pkl = os.path.join(save_dir, 'to_render.pkl')
     render_props = RenderProperties()
     render_props.model_name = name
     render_props.xyz = xyz
@@ -46,20 +51,23 @@ for i in range(n_eps):
     render_props.compute_gramian = True
     render_props.eps = eps[i]
     render_props.alpha = False
+    render_props.noise_floor = use_noise_floor
 
-    with open(to_render_pkl, 'wb') as output:
-        pickle.dump(render_props, output, pickle.HIGHEST_PROTOCOL)
-
+    bm.write_manifest(render_props, save_dir)
     br.blender_render(save_dir)
 
     # load gramian
-    gram_data = np.load(gram_npz)
-    gram_i = gram_data['gram']
+    gram_i = bm.load_gramian(save_dir)
     gram_i = gram_i[:,:,0]
     gram[:,:,i] = gram_i
+    if use_noise_floor:
+        noise[:,:,i] = bm.load_gramian(save_dir, name=bm.noise_name)[:,:,0]
 
 # for the record, save all gramians
-np.savez(gram_eps_npz, gram=gram)
+if use_noise_floor:
+    np.savez(gram_eps_npz, gram=gram, noise=noise)
+else:
+    np.savez(gram_eps_npz, gram=gram)
 
 # load saved data
 data = np.load(gram_eps_npz)
@@ -75,6 +83,12 @@ l2, = ax.plot(eps, gram[2,2,:], label='3,3')
 l3, = ax.plot(eps, gram[3,3,:], label='4,4')
 l4, = ax.plot(eps, gram[4,4,:], label='5,5')
 l5, = ax.plot(eps, gram[5,5,:], label='6,6')
+handles = [l0, l1, l2, l3, l4, l5]
+if use_noise_floor:
+    noise = data['noise']
+    l6, = ax.plot(eps, np.mean(np.diagonal(noise), axis=1), 'k--',
+                  label='noise')
+    handles.append(l6)
 ax.set_xscale('log')
 ax.set_yscale('log')
 ax.set_xlabel(r'$\epsilon$', fontsize=24)
@@ -83,7 +97,7 @@ ax.tick_params(axis='both', which='major', labelsize=13)
 fig.subplots_adjust(bottom=0.15, top=0.95)
 
 # legend
-leg = ax.legend(handles=[l0, l1, l2, l3, l4, l5], loc='upper right',
+leg = ax.legend(handles=handles, loc='upper right',
                 edgecolor='k', title='Gramian\nmatrix\nelement',
                 fontsize=12, labelspacing=.2)
 leg.get_title().set_fontsize('12')
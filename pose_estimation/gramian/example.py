@@ -1,13 +1,12 @@
-import os
 import sys
 import math
-import pickle
 import numpy as np
 import transforms3d as t3d
 
 import pose_estimation.directories as dirs
 import pose_estimation.tools.math as tm
 import pose_estimation.blender.render as br
+import pose_estimation.blender.manifest as bm
 from pose_estimation.blender.render_properties import RenderProperties
 
 # model info
@@ -29,7 +28,6 @@ quat = quat[:, np.newaxis] # make it a column vector
 
 # save render info to file
 save_dir = dirs.gramian_example_dir
-to_render_pkl = os.path.join(save_dir, 'to_render.pkl')
 render_props = RenderProperties()
 render_props.model_name = name
 render_props.xyz = xyz
@@ -38,13 +36,11 @@ render_props.compute_gramian = True
 render_props.alpha = False
 render_props.eps = 1e-2
 
-with open(to_render_pkl, 'wb') as output:
-    pickle.dump(render_props, output, pickle.HIGHEST_PROTOCOL)
+bm.write_manifest(render_props, save_dir)
 br.blender_render(save_dir)
 
 # load gramian
-data = np.load(os.path.join(save_dir, 'gramian.npz'))
-gram = data['gram']
+gram = bm.load_gramian(save_dir)
 gram = gram[:,:,0]
 
 # printing
@@ -0,0 +1,258 @@
+'''
+compare fast (approximate) ways of computing the Gramian to a reference way of
+computing it: for every model in the Blender models directory, the Gramians of
+a fixed set of poses are computed with a reference configuration and with
+candidate configurations, and the time and the error of each candidate are
+reported in a table (with the configurations which are Pareto optimal in time
+and error marked)
+
+Gramians of OpenEXR images are of linear pixel values, and those of PNG images
+are of sRGB pixel values, so they are different quantities: candidates are
+compared to the reference of their gramian_format, and are only Pareto
+optimal among the candidates of the same reference
+
+python pose_estimation/gramian/fast_modes.py
+'''
+import os
+import glob
+import json
+import numpy as np
+
+import pose_estimation.directories as dirs
+import pose_estimation.tools.timing as tt
+import pose_estimation.blender.render as br
+import pose_estimation.blender.manifest as bm
+import pose_estimation.gramian.functions as gf
+from pose_estimation.blender.render_properties import RenderProperties
+
+# save directory
+save_dir = dirs.fast_modes_dir
+
+# configurations: attributes of RenderProperties which are changed from their
+# defaults (candidates are changes to the reference configuration), exact
+# candidates (e.g. no_persistent_data, which checks that keeping render data
+# between renders does not change the renders) should have no error
+ref_config = {'int_diff': False}
+
+# reference of each gramian_format, OpenEXR candidates are compared to
+# OpenEXR Gramians with many samples, since there is no exact OpenEXR
+# counterpart of the PNG reference
+ref_configs = {
+    'PNG': ref_config,
+    'OPEN_EXR': {'int_diff': False, 'gramian_format': 'OPEN_EXR',
+                 'samples': 1024}}
+candidate_configs = {
+    'int_diff': {'int_diff': True},
+    'roi': {'roi': True},
+    'sparse_diff': {'sparse_diff': True},
+    'roi_sparse_diff': {'roi': True, 'sparse_diff': True},
+    'half_res': {'pix_width': 150, 'pix_height': 150},
+    'samples_32': {'samples': 32},
+    'samples_8': {'samples': 8},
+    'exr': {'gramian_format': 'OPEN_EXR'},
+    'no_persistent_data': {'persistent_data': False},
+    'lod_1': {'lod': 1},
+    'lod_2': {'lod': 2}}
+
+# distance of each model from the camera (models which are not listed use
+# rad_default)
+model_rad = {'chair': 2.0, 'car': 14, 'car2': 8, 'cone': 5, 'cube': 8,
+             'lamp': 1.6}
+rad_default = 5
+
+# fixed set of poses: random orientations (the same every time this is run)
+n_poses = 20
+rng = np.random.RandomState(0)
+quat = rng.randn(4, n_poses)
+quat = quat/np.linalg.norm(quat, axis=0)
+
+# measures of the Gramian whose argmin and argmax (over poses) are compared,
+# like in best_views.py
+measure_names = ['det', 'trace', 'min_eval', 'cond_num']
+
+
+def render_config(model_name, name, config):
+    '''
+    compute the Gramians of all poses of a model with a configuration
+
+    outputs:
+        gram: Gramians, size (6, 6, n_poses), scaled to the number of pixels
+              of the reference configuration
+        t: time (in seconds) spent computing the Gramians
+    '''
+
+    # the object is straight ahead of the default camera
+    rad = model_rad.get(model_name, rad_default)
+    xyz = np.tile(np.array([[0], [rad], [0]]), n_poses)
+
+    # render properties object
+    job_dir = os.path.join(save_dir, model_name, name)
+    if not os.path.isdir(job_dir):
+        os.makedirs(job_dir)
+    render_props = RenderProperties()
+    render_props.model_name = model_name
+    render_props.n_renders = n_poses
+    render_props.xyz = xyz
+    render_props.quat = quat
+    render_props.compute_gramian = True
+    render_props.alpha = False
+    render_props.trace = True
+    for key, val in config.items():
+        setattr(render_props, key, val)
+
+    # render, and time the gramian computation from the job's trace
+    trace_file = os.path.join(job_dir, 'trace.jsonl')
+    if os.path.isfile(trace_file):
+        os.remove(trace_file)
+    bm.write_manifest(render_props, job_dir)
+    br.blender_render(job_dir)
+    summary = tt.summarize([trace_file])
+    t = summary['spans']['compute_gramian_object']['total']
+
+    # entries of the gramian are sums over pixels, so scale them to the
+    # number of pixels of the reference configuration
+    ref_props = RenderProperties()
+    for key, val in ref_config.items():
+        setattr(ref_props, key, val)
+    scl = (ref_props.pix_width*ref_props.pix_height) / \
+          (render_props.pix_width*render_props.pix_height)
+    gram = scl*bm.load_gramian(job_dir)
+
+    return gram, t
+
+
+def gramian_errors(gram_ref, gram):
+    '''
+    errors of Gramians relative to reference Gramians
+
+    inputs:
+        gram_ref: reference Gramians, size (n_rows, n_cols, n_gramians)
+        gram: Gramians, size (n_rows, n_cols, n_gramians)
+
+    output: a dictionary with
+        'rel_fro': mean relative error in the Frobenius norm
+        'logdet': mean absolute error of the log-determinant
+        'extrema': fraction of the argmins and argmaxes (over Gramians) of the
+                   measures of measure_names which are preserved
+    '''
+
+    # relative Frobenius norm
+    diff_fro = np.linalg.norm(gram - gram_ref, axis=(0,1))
+    ref_fro = np.linalg.norm(gram_ref, axis=(0,1))
+    rel_fro = np.mean(diff_fro/ref_fro)
+
+    # log-determinant
+    sign_ref, logdet_ref = np.linalg.slogdet(np.moveaxis(gram_ref, 2, 0))
+    sign, logdet = np.linalg.slogdet(np.moveaxis(gram, 2, 0))
+    logdet_err = np.mean(np.abs(logdet - logdet_ref))
+
+    # argmin and argmax views
+    grm_ref = gf.gramian_measures(gram_ref)
+    grm = gf.gramian_measures(gram)
+    n_same = 0
+    for key in measure_names:
+        n_same += np.argmin(grm[key]) == np.argmin(grm_ref[key])
+        n_same += np.argmax(grm[key]) == np.argmax(grm_ref[key])
+    extrema = n_same/(2*len(measure_names))
+
+    return {'rel_fro': rel_fro, 'logdet': logdet_err, 'extrema': extrema}
+
+
+def pareto_front(t, err):
+    '''
+    which points are Pareto optimal, i.e. no other point has both a smaller
+    (or equal) time and a smaller (or equal) error, with one of them smaller
+
+    inputs: t, err: times and errors, size (n_points)
+    output: boolean array, size (n_points)
+    '''
+
+    t = np.asarray(t)
+    err = np.asarray(err)
+    opt = np.full(t.size, True)
+    for i in range(t.size):
+        dominated = (t <= t[i]) & (err <= err[i]) & \
+                    ((t < t[i]) | (err < err[i]))
+        opt[i] = not np.any(dominated)
+
+    return opt
+
+
+def evaluate_fast_modes():
+    '''
+    run the reference and candidate configurations on every model, print the
+    table of time and errors, and save it
+    '''
+
+    # models
+    blend_files = sorted(glob.glob(os.path.join(dirs.blender_models_dir,
+                                                '*.blend')))
+    model_names = [os.path.splitext(os.path.basename(f))[0]
+                   for f in blend_files]
+
+    # reference of each candidate
+    names = list(candidate_configs.keys())
+    configs = {}
+    ref_name = {}
+    for name in names:
+        configs[name] = dict(ref_config)
+        configs[name].update(candidate_configs[name])
+        ref_name[name] = configs[name].get('gramian_format', 'PNG')
+    refs = [ref for ref in ref_configs if ref in ref_name.values()]
+
+    # run every configuration, and sum times and average errors over models
+    t_ref = {ref: 0.0 for ref in refs}
+    t = {name: 0.0 for name in names}
+    err = {name: {'rel_fro': 0.0, 'logdet': 0.0, 'extrema': 0.0}
+           for name in names}
+    for model_name in model_names:
+        gram_ref = {}
+        for ref in refs:
+            gram_ref[ref], t_ref_i = render_config(
+                model_name, 'reference_' + ref.lower(), ref_configs[ref])
+            t_ref[ref] += t_ref_i
+        for name in names:
+            gram, t_i = render_config(model_name, name, configs[name])
+            t[name] += t_i
+            err_i = gramian_errors(gram_ref[ref_name[name]], gram)
+            for key, val in err_i.items():
+                err[name][key] += val/len(model_names)
+
+    # pareto optimal configurations in time and relative Frobenius error,
+    # among the candidates of each reference
+    opt = {}
+    for ref in refs:
+        names_ref = [name for name in names if ref_name[name] == ref]
+        opt_ref = pareto_front([t[name] for name in names_ref],
+                               [err[name]['rel_fro'] for name in names_ref])
+        opt.update(zip(names_ref, opt_ref))
+
+    # table, speedups are relative to the PNG reference
+    print('%-18s %-9s %10s %8s %10s %10s %9s %7s' % ('config', 'reference',
+          'time (s)', 'speedup', 'rel fro', 'logdet', 'extrema', 'pareto'))
+    for ref in refs:
+        print('%-18s %-9s %10.2f %8.2f %10.2e %10.2e %9.2f %7s' % (
+              'reference', ref, t_ref[ref], t_ref['PNG']/t_ref[ref], 0.0, 0.0,
+              1.0, ''))
+    table = []
+    for name in names:
+        row = {'config': name, 'reference': ref_name[name], 'time': t[name],
+               'speedup': t_ref['PNG']/t[name], 'pareto': bool(opt[name])}
+        row.update(err[name])
+        table.append(row)
+        print('%-18s %-9s %10.2f %8.2f %10.2e %10.2e %9.2f %7s' % (name,
+              ref_name[name], t[name], t_ref['PNG']/t[name],
+              err[name]['rel_fro'], err[name]['logdet'],
+              err[name]['extrema'], '*' if opt[name] else ''))
+
+    # save
+    table_file = os.path.join(save_dir, 'fast_modes.json')
+    with open(table_file, 'w') as output:
+        json.dump({'models': model_names,
+                   'references': {ref: ref_configs[ref] for ref in refs},
+                   'reference_time': t_ref, 'candidates': candidate_configs,
+                   'table': table}, output, indent=1, default=bm.to_json)
+
+
+if __name__ == '__main__':
+    evaluate_fast_modes()
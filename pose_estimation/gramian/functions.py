@@ -1,6 +1,54 @@
+import os
 import numpy as np
 import transforms3d as t3d
 import pose_estimation.tools.math as tm
+import pose_estimation.tools.image as ti
+import pose_estimation.tools.timing as tt
+
+# states of the gramian, in order (perturbations 2*j and 2*j + 1 are the
+# negative and positive perturbations of state j)
+state_names = ['x', 'y', 'z', 'x_rot', 'y_rot', 'z_rot']
+
+
+def gramian_states(states=None):
+    '''
+    indices of the states of a gramian which is computed for a subset of the
+    states (see RenderProperties.states), in increasing order
+
+    input: states: indices of states (into state_names), or None for all states
+    output: list of indices
+    '''
+
+    if states is None:
+        return list(range(len(state_names)))
+
+    states = sorted(set(int(j) for j in states))
+    if not states or states[0] < 0 or states[-1] >= len(state_names):
+        raise ValueError('states must be a nonempty subset of 0, ..., %d'
+                         % (len(state_names) - 1))
+
+    return states
+
+
+def sub_gramian(gram, states, gram_states=None):
+    '''
+    gramian of a subset of states, from a gramian of more states (each entry
+    of the gramian only depends on the images of its two states, so this is
+    the same as computing the gramian of the subset)
+
+    inputs:
+        gram: gramians, size (n, n, ...)
+        states: indices of the states of the subset
+        gram_states: indices of the n states of gram, or None for all states
+
+    output: gramians, size (len(states), len(states), ...)
+    '''
+
+    gram_states = gramian_states(gram_states)
+    ind = [gram_states.index(j) for j in gramian_states(states)]
+
+    return gram[np.ix_(ind, ind)]
+
 
 def standard_pert(xyz, quat, eps=1e-2):
     '''
@@ -71,12 +119,235 @@ def standard_pert(xyz, quat, eps=1e-2):
     return pert_xyz, pert_quat
 
 
+def sparse_diff(y_diff):
+    '''
+    sparse representation of the difference of two perturbation images, which
+    is nonzero only where the object (or its shading) changes
+
+    input:
+        y_diff: difference of two images, any size
+
+    outputs:
+        ind: flattened indices of the nonzero elements of y_diff
+        val: values of the nonzero elements of y_diff
+    '''
+
+    y_diff_vec = np.reshape(y_diff, -1)
+    ind = np.flatnonzero(y_diff_vec)
+    val = y_diff_vec[ind]
+
+    return ind, val
+
+
+def sparse_union(diffs, n_el):
+    '''
+    combine the sparse differences of all states into one matrix which only
+    has rows for the union of their nonzero elements, so that for the full
+    (dense) matrix of differences J, J^T J = mat.T @ mat
+
+    inputs:
+        diffs: list of (ind, val) of each state, see sparse_diff()
+        n_el: number of elements of each (dense) difference
+
+    outputs:
+        ind: flattened indices of the rows of mat, size (n_ind)
+        mat: differences of each state, size (n_ind, n_states)
+    '''
+
+    # union of the indices, with a mask rather than sorting them
+    n_states = len(diffs)
+    mask = np.zeros(n_el, dtype=bool)
+    for ind_j, val_j in diffs:
+        mask[ind_j] = True
+    ind = np.flatnonzero(mask)
+
+    # row of mat of each index
+    row = np.empty(n_el, dtype=np.intp)
+    row[ind] = np.arange(ind.size)
+    mat = np.zeros((ind.size, n_states), dtype=diffs[0][1].dtype)
+    for j, (ind_j, val_j) in enumerate(diffs):
+        mat[row[ind_j], j] = val_j
+
+    return ind, mat
+
+
+def load_pair(image_file_neg, image_file_pos, use_int_diff, use_exr=False):
+    '''
+    load the images of a negative and positive perturbation (which are already
+    superimposed on the background image, if there is one), use_exr if the
+    images are OpenEXR files
+
+    outputs: y_minus, y_plus, without alpha
+    '''
+
+    if use_exr:
+        # linear float32 entries
+        with tt.span('load_images'):
+            y_minus = ti.load_im_exr(image_file_neg)[:,:,:3]
+            y_plus = ti.load_im_exr(image_file_pos)[:,:,:3]
+
+    elif use_int_diff:
+        # entries from 0 to 255 (or 65535 for 16-bit images)
+        with tt.span('load_images'):
+            y_minus = ti.load_im_int(image_file_neg)[:,:,:3]
+            y_plus = ti.load_im_int(image_file_pos)[:,:,:3]
+
+    else:
+        # entries from 0 to 1
+        with tt.span('load_images'):
+            y_minus = ti.load_im_np(image_file_neg)[:,:,:3]
+            y_plus = ti.load_im_np(image_file_pos)[:,:,:3]
+
+    return y_minus, y_plus
+
+
+def diff_pair(y_minus, y_plus, use_int_diff):
+    '''
+    y^+ - y^-, as integers if use_int_diff
+    '''
+
+    if use_int_diff:
+        return ti.diff_im_int(y_plus, y_minus)
+
+    return y_plus - y_minus
+
+
+def decode_state(image_files_neg, image_files_pos, image_files_neg_b=None,
+                 image_files_pos_b=None, use_int_diff=True, use_exr=False,
+                 use_sparse=False, remove=True):
+    '''
+    load and compare the images of the negative and positive perturbations of
+    a state with every camera, the images are removed when they are loaded if
+    remove
+
+    image_files_neg, image_files_pos: image file of each camera
+    image_files_neg_b, image_files_pos_b: image file of each camera rendered
+                                          with the second seed (see
+                                          RenderProperties.noise_floor), or
+                                          None
+
+    output: for each camera, a dictionary with
+        'diff': y^+ - y^- as a vector, or if use_sparse, as (ind, val) (see
+                sparse_diff())
+        'noise': difference of y^+ - y^- of the two seeds as a vector, or None
+        'shape': shape of y^+ - y^-
+        'im_max': largest value of the images if use_int_diff, else None
+    '''
+
+    out = []
+    for c in range(len(image_files_neg)):
+        y_minus, y_plus = load_pair(image_files_neg[c], image_files_pos[c],
+                                    use_int_diff, use_exr)
+        y_diff = diff_pair(y_minus, y_plus, use_int_diff)
+        if use_int_diff:
+            im_max = np.iinfo(y_minus.dtype).max
+        else:
+            im_max = None
+            y_diff = y_diff.astype(np.float64, copy=False)
+        if use_sparse:
+            diff = sparse_diff(y_diff)
+        else:
+            diff = np.reshape(y_diff, y_diff.size)
+
+        if image_files_neg_b is not None:
+            y_minus_b, y_plus_b = load_pair(image_files_neg_b[c],
+                                            image_files_pos_b[c],
+                                            use_int_diff, use_exr)
+            y_diff_b = diff_pair(y_minus_b, y_plus_b, use_int_diff)
+            noise = np.reshape(y_diff.astype(np.float64) - y_diff_b,
+                               y_diff.size)
+            if remove:
+                os.remove(image_files_neg_b[c])
+                os.remove(image_files_pos_b[c])
+        else:
+            noise = None
+        if remove:
+            os.remove(image_files_neg[c])
+            os.remove(image_files_pos[c])
+
+        out.append({'diff': diff, 'noise': noise, 'shape': y_diff.shape,
+                    'im_max': im_max})
+
+    return out
+
+
+def finish_gramian(states, eps, use_sparse=False, deltas_files=None):
+    '''
+    compute the gramian of a render from the compared images of its states
+
+    inputs:
+        states: output of decode_state() of each state
+        eps: size of the perturbations
+        use_sparse: are the differences sparse?
+        deltas_files: if use_sparse, file of each camera which the sparse
+                      differences are saved to (the gramian is
+                      scl*mat.T @ mat), or None
+
+    outputs:
+        gram: gramian (the sum of the gramians of the cameras), size
+              (n_states, n_states)
+        noise: noise floor of the gramian (see RenderProperties.noise_floor),
+               size (n_states, n_states), or None
+        gram_cams: gramian of each camera, size (n_states, n_states, n_cams)
+    '''
+
+    n_states = len(states)
+    n_cams = len(states[0])
+
+    # for integer differences the entries are put on the interval [0, 1]
+    # here, instead of for every image
+    im_max = states[0][0]['im_max']
+    if im_max is not None:
+        scl = 1/(4*eps**2*im_max**2)
+    else:
+        scl = 1/(4*eps**2)
+
+    # gramian of each camera, the gramian of the rig is their sum
+    gram_cams = np.zeros((n_states, n_states, n_cams))
+    if states[0][0]['noise'] is not None:
+        noise = np.zeros((n_states, n_states))
+    else:
+        noise = None
+    for c in range(n_cams):
+        shape = states[0][c]['shape']
+
+        # matrix of y^+ - y^- vectors, with sparse differences, only the rows
+        # where some state has changed the image
+        with tt.span('gramian_math'):
+            if use_sparse:
+                ind, mat = sparse_union([state[c]['diff'] for state in states],
+                                        int(np.prod(shape)))
+            else:
+                mat = np.column_stack([state[c]['diff'] for state in states])
+
+        # save sparse differences
+        if use_sparse and deltas_files is not None:
+            np.savez(deltas_files[c], ind=ind, mat=mat, scl=scl, shape=shape)
+
+        # for integer differences, float64 is exact and avoids overflow
+        with tt.span('gramian_math'):
+            mat = mat.astype(np.float64, copy=False)
+            gram_cams[:,:,c] = scl*mat.T @ mat
+
+            # noise floor, the bias of scl*mat.T @ mat due to noise is
+            # estimated by half of the same product of the noise of two seeds
+            # (the noise of each seed adds to it)
+            if noise is not None:
+                noise_mat = np.column_stack([state[c]['noise']
+                                             for state in states])
+                noise += (scl/2)*noise_mat.T @ noise_mat
+
+    return np.sum(gram_cams, axis=2), noise, gram_cams
+
+
+@tt.timed('gramian_measures')
 def gramian_measures(gram):
     '''
     compute various measures of the gramian
 
     input:
-    gram: an array of Gramians, of dimension (n_rows, n_cols, n_gramians)
+    gram: an array of Gramians, of dimension (n_rows, n_cols, n_gramians), of
+          all states or of a subset of them (see gramian_states())
 
     output:
     a dictionary containing the trace, determinant, minimum eigenvalue of each
@@ -137,3 +408,31 @@ def gramian_measures(gram):
                  'min_eval_inv_nrm': min_eval_inv_nrm}
 
     return gram_dict
+
+
+def gramian_from_images(image_files, eps, use_int_diff=True, use_exr=False,
+                        use_sparse=False, deltas_files=None):
+    '''
+    load and compare the images of all states of a render, and compute its
+    gramian, i.e. decode_state() of each state and then finish_gramian(), the
+    images are removed when they are loaded
+
+    this only reads files and returns small arrays, so it can run in a worker
+    process while blender renders the next images (blender holds the GIL while
+    it renders, so threads would not run at the same time)
+
+    inputs:
+        image_files: for each state, the image files of each camera
+                     (neg, pos, neg_b, pos_b), see decode_state()
+        eps, use_sparse, deltas_files: see finish_gramian()
+
+    outputs: gram, noise, gram_cams, see finish_gramian()
+    '''
+
+    states = []
+    for neg, pos, neg_b, pos_b in image_files:
+        with tt.span('decode_state'):
+            states.append(decode_state(neg, pos, neg_b, pos_b, use_int_diff,
+                                       use_exr, use_sparse))
+
+    return finish_gramian(states, eps, use_sparse, deltas_files)
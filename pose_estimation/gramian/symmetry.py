@@ -0,0 +1,345 @@
+'''
+symmetries of models, so that a sweep of camera poses only renders one pose of
+each set of poses which are related by a symmetry of the model (a fundamental
+domain of the sweep), and the Gramians of the other poses are found by
+transforming the Gramian of the pose which was rendered
+
+a symmetry is a rotation or reflection S (in the frame of the object, about
+its origin) which leaves the object unchanged, if a camera pose is moved by S
+(relative to the object), the image is the same (or mirrored, if S is a
+reflection), and the Gramian is the same up to a change of the coordinates of
+the perturbations, see gramian_transform()
+
+the symmetry must hold for the whole scene around the object, i.e. the lamps
+and the world must be symmetric too (e.g. uniform world lighting, or lamps on
+the axis of the object), the lamps are fixed in the world, so this is only
+checked for the pose of the object in its .blend file, see detect_symmetry()
+(e.g. the mesh of cone.blend is symmetric about z, but its area lamp and four
+point lamps are not)
+'''
+import os
+import json
+import math
+import numpy as np
+
+import pose_estimation.directories as dirs
+import pose_estimation.tools.math as tm
+import pose_estimation.blender.render as br
+
+# a symmetry is a dictionary, about the origin of the object's frame:
+#     'axis': axis of rotational symmetry, 'x', 'y', or 'z'
+#     'order': n for n-fold rotational symmetry, 0 for continuous
+#     'mirror': is the object also symmetric under reflections in the planes
+#               which contain the axis? (one of them contains the next axis,
+#               e.g. the xz plane for 'z', the yx plane for 'x')
+
+# the axis, and the two axes which are perpendicular to it (azimuth is
+# measured from the first towards the second)
+axis_inds = {'x': (0, 1, 2), 'y': (1, 2, 0), 'z': (2, 0, 1)}
+
+# decimals that camera poses are rounded to when comparing them
+decimals = 6
+
+
+def symmetry_file(model_name):
+    '''
+    file which the detected symmetry of a model is cached in, next to its
+    .blend file
+    '''
+
+    return os.path.join(dirs.blender_models_dir,
+                        model_name + '_symmetry.json')
+
+
+def save_symmetry(model_name, sym):
+    '''
+    cache the detected symmetry of a model (or None)
+    '''
+
+    with open(symmetry_file(model_name), 'w') as output:
+        json.dump({'symmetry': sym}, output)
+
+
+def model_symmetry(model_name):
+    '''
+    symmetry of a model (of its mesh and the lamps of its scene), or None
+
+    the symmetry is detected in blender (see
+    pose_estimation/blender/detect_symmetry.py) the first time it is used, or
+    when the model's .blend file has changed since it was cached, if blender
+    fails, the model is treated as not symmetric
+    '''
+
+    sym_file = symmetry_file(model_name)
+    blend_file = os.path.join(dirs.blender_models_dir, model_name + '.blend')
+    if not os.path.isfile(sym_file) or \
+       os.path.getmtime(sym_file) < os.path.getmtime(blend_file):
+        br.blender_detect_symmetry([model_name])
+        if not os.path.isfile(sym_file):
+            return None
+
+    with open(sym_file) as input:
+        return json.load(input)['symmetry']
+
+
+def axis_rotation(sym, ang):
+    '''
+    rotation by ang about the axis of a symmetry, size (3, 3)
+    '''
+
+    return tm.axis_rotation(ang, axis_inds[sym['axis']][0])
+
+
+def axis_reflection(sym, ang):
+    '''
+    reflection in the plane which contains the axis of a symmetry, at azimuth
+    ang, size (3, 3)
+    '''
+
+    i, j, k = axis_inds[sym['axis']]
+    S = np.eye(3)
+    S[j,j] = math.cos(2*ang)
+    S[j,k] = math.sin(2*ang)
+    S[k,j] = math.sin(2*ang)
+    S[k,k] = -math.cos(2*ang)
+
+    return S
+
+
+def rotate_to_domain(sym, cam_xyz_b, cam_R_b):
+    '''
+    rotation about the axis of a symmetry which moves a camera (in the frame
+    of the object) to the smallest azimuth it can be moved to
+
+    inputs:
+        cam_xyz_b: position of camera in the object frame, size (3)
+        cam_R_b: rotation matrix of camera in the object frame, size (3, 3)
+    '''
+
+    i, j, k = axis_inds[sym['axis']]
+
+    # azimuth of the camera, or if it is on the axis, of its up direction
+    vec = cam_xyz_b
+    if math.hypot(vec[j], vec[k]) < 10**-decimals*max(np.linalg.norm(vec), 1):
+        vec = cam_R_b[:,1]
+    ang = math.atan2(vec[k], vec[j])
+
+    if sym['order'] == 0:
+        return axis_rotation(sym, -ang)
+
+    step = 2*math.pi/sym['order']
+    n_steps = math.floor((ang + 10**-decimals)/step)
+
+    return axis_rotation(sym, -n_steps*step)
+
+
+def pose_key(cam_xyz_b, cam_R_b):
+    '''
+    hashable, rounded camera pose (in the object frame), the x-axis of the
+    camera is not used, so a mirrored camera has the same key
+    '''
+
+    pose = np.concatenate((cam_xyz_b, cam_R_b[:,1], cam_R_b[:,2]))
+
+    return tuple(np.round(pose, decimals) + 0.0) # + 0.0 makes -0.0 0.0
+
+
+def canonical_camera(sym, cam_xyz_b, cam_R_b):
+    '''
+    symmetry S which moves a camera (in the frame of the object) into the
+    fundamental domain of a symmetry, and the key of the moved camera pose,
+    S is chosen so that cameras which are related by a symmetry have the same
+    key
+
+    inputs:
+        cam_xyz_b: position of camera in the object frame, size (3)
+        cam_R_b: rotation matrix of camera in the object frame, size (3, 3)
+
+    outputs:
+        S: symmetry, size (3, 3)
+        key: key of the moved camera pose, see pose_key()
+    '''
+
+    if sym is None:
+        return np.eye(3), pose_key(cam_xyz_b, cam_R_b)
+
+    # candidates: rotate the camera, or reflect and then rotate it, and choose
+    # the candidate with the smallest key
+    candidates = [np.eye(3)]
+    if sym['mirror']:
+        candidates.append(axis_reflection(sym, 0))
+    best = None
+    for M in candidates:
+        S = rotate_to_domain(sym, M @ cam_xyz_b, M @ cam_R_b) @ M
+        key = pose_key(S @ cam_xyz_b, S @ cam_R_b)
+        if best is None or key < best[1]:
+            best = (S, key)
+
+    return best
+
+
+def gramian_transform(R_r, S_r, R_i, S_i):
+    '''
+    transform of the Gramian of a camera pose which was rendered (r) to the
+    Gramian of a camera pose which is related to it by a symmetry (i), such
+    that gram_i = T.T @ gram_r @ T (see transform_gramian())
+
+    translational perturbations are in the world frame, and rotational
+    perturbations are in the object frame, the Gramian is first expressed with
+    both in the object frame, and moved to the common (canonical) camera pose
+    by the symmetry: translations transform as vectors, and rotations as
+    pseudovectors (which change sign under reflections)
+
+    inputs:
+        R_r, R_i: rotation matrices of the object, size (3, 3)
+        S_r, S_i: symmetries which move the cameras (in the object frame) to
+                  the canonical camera pose, see canonical_camera(), size (3, 3)
+
+    output: T, size (6, 6)
+    '''
+
+    def world_to_body(R):
+        B = np.eye(6)
+        B[:3,:3] = R.T
+        return B
+
+    def body_to_canonical(S):
+        A = np.zeros((6, 6))
+        A[:3,:3] = S
+        A[3:,3:] = np.linalg.det(S)*S
+        return A
+
+    T = world_to_body(R_r).T @ body_to_canonical(S_r).T @ \
+        body_to_canonical(S_i) @ world_to_body(R_i)
+
+    return T
+
+
+def transform_gramian(gram, T):
+    '''
+    gram_i = T.T @ gram @ T, for Gramians of size (6, 6) or (6, 6, n)
+    '''
+
+    if gram.ndim == 2:
+        return T.T @ gram @ T
+
+    return np.einsum('ji,jkn,kl->iln', T, gram, T)
+
+
+def reduce_sweep(sym, xyz, quat, cam_xyz, cam_quat):
+    '''
+    find which poses of a sweep must be rendered, i.e. one pose of each set of
+    poses which are related by a symmetry
+
+    inputs:
+        sym: symmetry of the model, see model_symmetry(), or None
+        xyz, quat: positions and quaternions of the object, size (3, n) and
+                   (4, n)
+        cam_xyz, cam_quat: positions and quaternions of the camera, size (3, n)
+                           and (4, n)
+
+    outputs:
+        src: for each pose, the index of the pose which is rendered for it,
+             size (n), the poses which are rendered are those with src[i] == i
+        T: transforms from the Gramians of the rendered poses, so
+           gram[:,:,i] = transform_gramian(gram[:,:,src[i]], T[:,:,i]),
+           size (6, 6, n)
+    '''
+
+    n = xyz.shape[1]
+    src = np.arange(n)
+    T = np.tile(np.eye(6)[:,:,np.newaxis], (1, 1, n))
+    rendered = {} # key: (index, object rotation, symmetry)
+    R_all = tm.quat2mat(quat)
+    cam_R_all = tm.quat2mat(cam_quat)
+    for i in range(n):
+        R = R_all[i]
+        cam_xyz_b = R.T @ (cam_xyz[:,i] - xyz[:,i])
+        cam_R_b = R.T @ cam_R_all[i]
+        S, key = canonical_camera(sym, cam_xyz_b, cam_R_b)
+        if key not in rendered:
+            rendered[key] = (i, R, S)
+            continue
+        r, R_r, S_r = rendered[key]
+        src[i] = r
+        T[:,:,i] = gramian_transform(R_r, S_r, R, S)
+
+    return src, T
+
+
+def detect_symmetry(verts, lamp_xyz=None, lamp_dir=None, tol=1e-3,
+                    max_order=64):
+    '''
+    detect the symmetry of a mesh from its vertices (e.g. from
+    pose_estimation.blender.functions.object_vertices()), i.e. the axis with
+    the largest order of rotational symmetry, which is also a symmetry of the
+    lamps of the scene if they are given (e.g. from
+    pose_estimation.blender.functions.object_lamps())
+
+    the lamps are compared by their positions and directions only (not by
+    their type, strength, color, or shape), and the world must be checked
+    separately
+
+    inputs:
+        verts: vertices, in the object frame, size (3, n_verts)
+        lamp_xyz: positions of the lamps, in the object frame, size
+                  (3, n_lamps)
+        lamp_dir: directions of the lamps, in the object frame, size
+                  (3, n_lamps)
+        tol: tolerance, relative to the size of the mesh
+        max_order: largest order which is checked, an axis with a larger
+                   order is treated as continuous
+
+    output: symmetry (a dictionary, see the top of this file) or None
+    '''
+
+    # scipy is only needed here, so that blender's python does not need it to
+    # import this module
+    from scipy.spatial import cKDTree
+
+    verts = np.asarray(verts).T
+    tree = cKDTree(verts)
+    dist_tol = tol*np.amax(np.linalg.norm(verts, axis=1))
+
+    # a lamp is a point (position, direction), scaled so that a direction
+    # error of tol has the same weight as a position error of dist_tol
+    if lamp_xyz is not None and np.size(lamp_xyz):
+        lamp_xyz = np.asarray(lamp_xyz).T
+        lamp_dir = np.asarray(lamp_dir).T
+        dir_scl = dist_tol/tol
+        lamp_tree = cKDTree(np.concatenate((lamp_xyz, dir_scl*lamp_dir), 1))
+    else:
+        lamp_tree = None
+
+    def is_symmetry(S):
+        dist, ind = tree.query(verts @ S.T)
+        if np.amax(dist) >= dist_tol:
+            return False
+        if lamp_tree is None:
+            return True
+        lamp_dist, ind = lamp_tree.query(np.concatenate(
+            (lamp_xyz @ S.T, dir_scl*lamp_dir @ S.T), 1))
+        return np.amax(lamp_dist) < dist_tol
+
+    best = None
+    for axis in ['x', 'y', 'z']:
+        sym = {'axis': axis, 'order': 0, 'mirror': False}
+        if is_symmetry(axis_rotation(sym, 2*math.pi/(max_order + 1))):
+            order = 0 # continuous
+        else:
+            order = 1
+            for n in range(max_order, 1, -1):
+                if is_symmetry(axis_rotation(sym, 2*math.pi/n)):
+                    order = n
+                    break
+        if order == 1:
+            continue
+        sym['order'] = order
+        sym['mirror'] = bool(is_symmetry(axis_reflection(sym, 0)))
+
+        # continuous is best, then the largest order
+        if best is None or order == 0 or \
+           (best['order'] != 0 and order > best['order']):
+            best = sym
+
+    return best
@@ -1,13 +1,14 @@
 import os
 import math
-import pickle
 import numpy as np
-import transforms3d as t3d
 
 import pose_estimation.directories as dirs
 import pose_estimation.tools.math as tm
 import pose_estimation.blender.render as br
+import pose_estimation.blender.manifest as bm
 import pose_estimation.gramian.functions as gf
+import pose_estimation.gramian.symmetry as gs
+from pose_estimation.gramian.checkpoint import GramianCheckpoint
 from pose_estimation.blender.render_properties import RenderProperties
 
 # object and camera
@@ -41,6 +42,12 @@ ang_x = np.reshape(ang_x, n_ang)
 ang_z = np.reshape(ang_z, n_ang)
 ang_xz = np.stack((ang_x, ang_z), 1)
 
+# only render one of each set of points (of all semicircles) which are related
+# by a symmetry of the model? (the symmetry of the model and the lamps of its
+# scene is detected in blender the first time, see
+# pose_estimation/gramian/symmetry.py)
+use_symmetry = False
+
 # camera properties
 lens = 32
 sensor_width = 36
@@ -73,27 +80,22 @@ def semicircle(rad, n_coord, ang_x, ang_z, xyz_offset):
     create a semi-circular curve
     '''
 
-    # coordinates of the points which define the curve
+    # coordinates of the points which define the curve, negative-to-positive
+    # in x-direction
     theta = np.linspace(0, math.pi, n_coord)
-    coord = np.full((3, n_coord), np.nan)
- 
+    coord = np.stack((-rad*np.cos(theta), np.zeros(n_coord),
+                      rad*np.sin(theta)))
+
     # camera
     # rotation matrix for camera when ang_x = ang_z = 0
     # blender frame to default frame (y forward, x right, z up)
     R_def = tm.R_x(math.pi/2)
     R_semi = tm.R_z(-math.pi/2) # default frame to frame of 1st semicircle
-    cam_quat = np.full((4, n_coord), np.nan) # to be filled
-
-    # calcuate each coordinate
-    for i in range(n_coord):
-        # coordinates of semicircle, negative-to-positive in x-direction
-        coord[:,i] = [-rad*math.cos(theta[i]), 0, rad*math.sin(theta[i])]
 
-        # rotation matrix from camera frame to default Blender camera
-        R_ij = tm.R_z(ang_z) @ tm.R_x(ang_x) @ tm.R_y(theta[i]) @ R_semi \
-               @ R_def
-
-        cam_quat[:,i] = t3d.quaternions.mat2quat(R_ij)
+    # rotation matrices from camera frame to default Blender camera, for all
+    # coordinates, size (n_coord, 3, 3)
+    R = tm.R_z(ang_z) @ tm.R_x(ang_x) @ tm.R_y(theta) @ R_semi @ R_def
+    cam_quat = tm.mat2quat(R)
 
     # rotate all coordinates
     coord = tm.R_z(ang_z) @ tm.R_x(ang_x) @ coord
@@ -110,23 +112,53 @@ def evaluate_all_trajectories():
 
     # rendering
     save_dir = dirs.trajectories_dir
-    # integrated gramian for all trajectories
-    gram_all = np.full((6, 6, n_ang), np.nan)
+    # gramian of every point of every semicircle, checkpointed so that if the
+    # sweep is interrupted, the points which have been computed are skipped
+    # when it is run again
+    ckpt = GramianCheckpoint(save_dir, n_ang*n_pts,
+                             name='trajectories_' + model_name)
+
+    # camera poses of all points of all semicircles
+    coord_all = np.full((3, n_ang, n_pts), np.nan)
+    cam_quat_all = np.full((4, n_ang, n_pts), np.nan)
+    for i in range(n_ang):
+        coord_all[:,i,:], cam_quat_all[:,i,:] = semicircle(
+            rad, n_pts, ang_x[i], ang_z[i], xyz_cent_col)
+
+    # if the model is symmetric, only render the points which are not related
+    # to another point by a symmetry, src[ij] is the point which is rendered
+    # for point ij (see pose_estimation/gramian/symmetry.py)
+    if use_symmetry:
+        sym = gs.model_symmetry(model_name)
+    else:
+        sym = None
+    src, T = gs.reduce_sweep(sym, np.tile(xyz_col, n_ang*n_pts),
+                             np.tile(quat_col, n_ang*n_pts),
+                             np.reshape(coord_all, (3, n_ang*n_pts)),
+                             np.reshape(cam_quat_all, (4, n_ang*n_pts)))
+
     # loop over semicircles
     for i in range(n_ang):
-        gram = np.full((6, 6), 0.0)
-        coord, cam_quat = semicircle(rad, n_pts, ang_x[i], ang_z[i],
-                                     xyz_cent_col)
+        coord = coord_all[:,i,:]
+        cam_quat = cam_quat_all[:,i,:]
+        job_dirs = [] # one job per point, all rendered together
+        job_inds = []
+
+        # the jobs write their gramians into a shared array (in memory, if
+        # possible), gram_share[:,:,k] is the gramian of job k
+        share_file, gram_share = bm.create_shared_result((6, 6, n_pts))
 
         # loop over points along semicircle
         for j in range(n_pts):
+            ij = i*n_pts + j
+            if ckpt.is_done(ij) or src[ij] != ij:
+                continue
 
             # render
             cam_pos_ij = np.expand_dims(coord[:,j], 1)
             cam_quat_ij = np.expand_dims(cam_quat[:,j], 1)
 
             # render properties object
-            to_render_pkl = os.path.join(save_dir, 'to_render.pkl')
             render_props = RenderProperties()
             render_props.model_name = model_name
             render_props.xyz = xyz_col
@@ -138,21 +170,50 @@ def evaluate_all_trajectories():
             render_props.sensor_height = sensor_height
             render_props.compute_gramian = True
             render_props.alpha = False
-            render_props.image_names=['%03d' % j]
-
-            with open(to_render_pkl, 'wb') as output:
-                pickle.dump(render_props, output, pickle.HIGHEST_PROTOCOL)
-            br.blender_render(save_dir)
-            
-            # load gramian
-            gram_npz = os.path.join(save_dir, 'gramian.npz')
-            gram_data = np.load(gram_npz)
-            gram_ij = gram_data['gram']
-            gram += gram_ij[:,:,0]
-
-        # save integrated gramian
-        gram_all[:,:,i] = gram
-        
+            render_props.image_names=[os.path.join(save_dir, '%03d' % j)]
+            render_props.result_file = share_file
+            render_props.result_offset = len(job_inds)
+
+            job_dir_j = br.job_dir(save_dir, j)
+            bm.write_manifest(render_props, job_dir_j)
+            job_dirs.append(job_dir_j)
+            job_inds.append(ij)
+
+        # render all points of the semicircle in one blender session, and
+        # read gramians, gramians of a failed blender session (or which were
+        # not written) are not marked as done, so they are computed again
+        # when this is run again
+        proc = br.blender_render(job_dirs)
+        if proc is not None and proc.returncode != 0:
+            print('blender failed for semicircle %d, its gramians will be '
+                  'retried' % i)
+        elif proc is not None:
+            for k, ij in enumerate(job_inds):
+                if not np.isnan(gram_share[:,:,k]).any():
+                    ckpt.write(ij, gram_share[:,:,k])
+        del gram_share
+        os.remove(share_file)
+
+    # gramians of the points which were not rendered, from the points related
+    # to them by a symmetry
+    for ij in ckpt.todo():
+        if ckpt.is_done(src[ij]):
+            ckpt.write(ij, gs.transform_gramian(ckpt.gram_data[src[ij]],
+                                                T[:,:,ij]))
+
+    # the measures need every gramian (a missing point makes the integrated
+    # gramian of its semicircle NaN), stop if a blender session failed
+    missing = ckpt.todo()
+    if missing.size:
+        print('the gramians of points %s are missing, run this script again '
+              'to render them' % missing.tolist())
+        return
+
+    # integrated gramian for all trajectories
+    gram_pts = ckpt.gram()
+    gram_pts = np.reshape(gram_pts, (6, 6, n_ang, n_pts))
+    gram_all = np.sum(gram_pts, axis=3)
+
     # calculate measures of all integrated gramians
     grm = gf.gramian_measures(gram_all)
     det_min_ind = np.argmin(grm['det'])
@@ -12,47 +12,34 @@ import pose_estimation.directories as dirs
 import pose_estimation.tools.math as tm
 import pose_estimation.blender.functions as bf
 import pose_estimation.gramian.trajectories as gt
+from pose_estimation.blender.scene import SceneManager
+from pose_estimation.blender.render_properties import RenderProperties
 
 # see: https://blender.stackexchange.com/questions/6750/poly-bezier-curve-
 # from-a-list-of-coordinates
 
-# model info
-blender_models_dir = dirs.blender_models_dir
-blend_file = os.path.join(blender_models_dir, gt.model_name+'.blend')
-bpy.ops.wm.open_mainfile(filepath=blend_file)
-ob_name = 'all_parts'
-ob = bpy.data.objects[ob_name]
-ob_pos = gt.xyz
-ob_quat = gt.quat
-
-# set up camera
-camera_name = 'cam0'
-cam = bpy.data.cameras.new(camera_name)  # create a new camera
-
-# define camera
-cam_ob = bpy.data.objects.new(camera_name, cam)  # create a new camera object
-bpy.context.scene.camera = cam_ob  # set the active camera
+# model, camera, and scene properties, set up by a scene manager like the
+# renders of pose_estimation/blender/process_renders.py
 cam_dist = 9.9
 cam_pos = [cam_dist, -cam_dist, cam_dist] + gt.xyz_cent
 cam_euler = [0.96, 0, .78]
 cam_quat = t3d.euler.euler2quat(*cam_euler, axes='sxyz')
-bpy.data.objects[camera_name].location = cam_pos
-bpy.data.objects[camera_name].rotation_euler = cam_euler
-
+render_props = RenderProperties()
+render_props.model_name = gt.model_name
+render_props.cam_xyz = cam_pos
+render_props.cam_quat = cam_quat
 # camer lens: based on Canon Powershot A2500
-bpy.data.cameras[camera_name].lens = gt.lens
-bpy.data.cameras[camera_name].sensor_width = gt.sensor_width
-bpy.data.cameras[camera_name].sensor_height = gt.sensor_height
-
-# scene properties
-bpy.data.scenes['Scene'].render.resolution_x = 1000
-bpy.data.scenes['Scene'].render.resolution_y = 1000
-bpy.data.scenes['Scene'].render.resolution_percentage = 100
-bpy.data.scenes['Scene'].render.image_settings.color_mode = 'RGBA'
-bpy.data.scenes['Scene'].render.image_settings.file_format = 'PNG'
-bpy.data.scenes['Scene'].cycles.film_transparent = True
-bpy.data.scenes['Scene'].render.engine = 'CYCLES'
-bpy.data.scenes['Scene'].cycles.device = 'GPU'
+render_props.lens = gt.lens
+render_props.sensor_width = gt.sensor_width
+render_props.sensor_height = gt.sensor_height
+render_props.pix_width = 1000
+render_props.pix_height = 1000
+scene_manager = SceneManager()
+scene_manager.setup(render_props)
+ob = render_props.ob
+ob_pos = gt.xyz
+ob_quat = gt.quat
+cam_ob = render_props.cam_ob
 
 # load optimal trajectory data
 opt_ang_npz = os.path.join(dirs.trajectories_dir, 'opt_ang.npz')
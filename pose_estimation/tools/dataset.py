@@ -0,0 +1,152 @@
+'''
+write rendered images and their pose labels to sharded tar files (in the
+WebDataset layout: each sample is a key.png image and a key.json label), the
+images are loaded and encoded by a pool of worker processes, so that rendering
+does not wait for them (blender holds the GIL while it renders, so threads
+would not run at the same time)
+'''
+import os
+import io
+import cv2
+import json
+import tarfile
+import collections
+import numpy as np
+import concurrent.futures
+
+
+def encode_sample(image_file, remove=True):
+    '''
+    load a rendered image and encode it as png (background images are
+    superimposed by the compositor when the image is rendered)
+
+    output: png bytes
+    '''
+
+    im = cv2.imread(image_file, cv2.IMREAD_UNCHANGED)
+    if remove:
+        os.remove(image_file)
+
+    ok, png = cv2.imencode('.png', im)
+    if not ok:
+        raise IOError('could not encode ' + image_file)
+
+    return png.tobytes()
+
+
+class ShardWriter:
+    '''
+    write samples to save_dir/prefix_000000.tar, save_dir/prefix_000001.tar,
+    ..., with shard_size samples per shard
+
+    samples are encoded by n_processes worker processes, and written to the
+    shards in the order they were added, at most max_pending samples wait to
+    be written
+    '''
+
+    def __init__(self, save_dir, prefix='shard', shard_size=1000,
+                 n_processes=4, max_pending=None):
+        self.save_dir = save_dir
+        self.prefix = prefix
+        self.shard_size = shard_size
+        if max_pending is None:
+            max_pending = 4*n_processes
+        self.max_pending = max_pending
+        self.pool = concurrent.futures.ProcessPoolExecutor(n_processes)
+        self.pending = collections.deque() # (key, label, future of image)
+        self.shard = None
+        self.n_shards = 0
+        self.n_in_shard = 0
+        self.n_samples = 0
+
+    def add(self, key, image_file, label):
+        '''
+        add a sample: the rendered image image_file (which is removed when it
+        has been encoded), and a label dictionary (which must be json
+        serializable, numpy arrays are converted to lists)
+        '''
+
+        future = self.pool.submit(encode_sample, image_file)
+        self.pending.append((key, label, future))
+
+        # write the samples which are done, and wait if too many are pending
+        while self.pending and (self.pending[0][2].done() or
+                                len(self.pending) > self.max_pending):
+            self.write_next()
+
+    def write_next(self):
+        '''
+        write the oldest pending sample (waiting for it to be encoded)
+        '''
+
+        key, label, future = self.pending.popleft()
+        png = future.result()
+        label_json = json.dumps(label, default=lambda x: x.tolist())
+
+        if self.shard is None:
+            shard_file = os.path.join(self.save_dir, '%s_%06d.tar'
+                                      % (self.prefix, self.n_shards))
+            self.shard = tarfile.open(shard_file, 'w')
+        self.write_member(key + '.png', png)
+        self.write_member(key + '.json', label_json.encode('utf-8'))
+        self.n_samples += 1
+
+        # start a new shard?
+        self.n_in_shard += 1
+        if self.n_in_shard == self.shard_size:
+            self.shard.close()
+            self.shard = None
+            self.n_shards += 1
+            self.n_in_shard = 0
+
+    def write_member(self, name, data):
+        '''
+        write one file to the current shard
+        '''
+
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self.shard.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        '''
+        write all pending samples and close the last shard
+        '''
+
+        while self.pending:
+            self.write_next()
+        self.pool.shutdown()
+        if self.shard is not None:
+            self.shard.close()
+            self.shard = None
+            self.n_shards += 1
+            self.n_in_shard = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def read_shard(shard_file):
+    '''
+    read the samples of a shard
+
+    output: generator of (key, image, label), image is a uint8 numpy array
+            (RGB or RGBA)
+    '''
+
+    with tarfile.open(shard_file, 'r') as shard:
+        members = shard.getmembers()
+        for im_member, label_member in zip(members[0::2], members[1::2]):
+            key = os.path.splitext(im_member.name)[0]
+            png = np.frombuffer(shard.extractfile(im_member).read(), np.uint8)
+            im = cv2.imdecode(png, cv2.IMREAD_UNCHANGED)
+            if im.ndim == 3 and im.shape[2] == 4:
+                im = cv2.cvtColor(im, cv2.COLOR_BGRA2RGBA)
+            elif im.ndim == 3:
+                im = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
+            label = json.loads(shard.extractfile(label_member).read()
+                               .decode('utf-8'))
+            yield key, im, label
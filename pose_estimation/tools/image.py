@@ -1,4 +1,6 @@
 import os
+# opencv only reads OpenEXR images if this is set before it is imported
+os.environ.setdefault('OPENCV_IO_ENABLE_OPENEXR', '1')
 import cv2
 import glob
 import imageio
@@ -21,6 +23,47 @@ def load_im_np(filename):
     return d
 
 
+def load_im_int(filename):
+    '''
+    load 1 image to a numpy array, without converting it to floating point
+    resulting array will be of type uint8 (entries on the interval [0, 255]) or
+    uint16 (entries on the interval [0, 65535]) depending on the bit depth of
+    the image
+    '''
+
+    return np.asarray(imageio.imread(filename))
+
+
+def load_im_exr(filename):
+    '''
+    load 1 OpenEXR image to a numpy array, without any conversion, resulting
+    array will be of type float32 with linear (not gamma corrected) entries,
+    channels are in RGB or RGBA order
+    '''
+
+    im = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
+    if im is None:
+        raise IOError('could not read ' + filename)
+    if im.shape[2] == 4:
+        return cv2.cvtColor(im, cv2.COLOR_BGRA2RGBA)
+
+    return cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
+
+
+def diff_im_int(im_plus, im_minus):
+    '''
+    difference of two integer images, of type int16 for 8-bit images and type
+    int32 for 16-bit images (so the difference cannot overflow)
+    '''
+
+    if im_plus.dtype == np.uint8:
+        diff_dtype = np.int16
+    else:
+        diff_dtype = np.int32
+
+    return np.subtract(im_plus, im_minus, dtype=diff_dtype)
+
+
 def write_im_np(filename, im):
     '''
     take an array with entries on the interval [0, 1] and save it as an image
@@ -60,3 +103,34 @@ def overlay(im_overlay, im_background, mode='0to1'):
     im_out = im_overlay_scaled + im_background_scaled
 
     return im_out
+
+
+def overlay_stack(im_overlays, im_background, mode='0to1'):
+    '''
+    overlay a stack of RGBA images onto an RGB background image in one
+    vectorized back-to-front pass, this gives the same result as calling
+    overlay() repeatedly, starting with the first image of the stack
+
+    INPUTS
+    im_overlays: RGBA images, size (n_images, height, width, 4), ordered from
+                 back (index 0) to front (index n_images-1)
+    im_background: RGB image
+    mode: '0to1' (image elements are from 0 to 1),
+          '0to255' (image elements are from 0 to 255)
+    '''
+
+    alph = im_overlays[:,:,:,3]
+
+    if mode == '0to255':
+        alph = alph/255.0 # now alpha values are in interval [0,1]
+
+    # transmittance of each image, i.e. the fraction of it which is visible
+    # through all of the images in front of it
+    trans = np.cumprod((1 - alph)[::-1], axis=0)[::-1]
+    trans_front = np.concatenate((trans[1:], np.ones_like(trans[:1])))
+    wgt = alph*trans_front
+
+    im_out = np.sum(wgt[:,:,:,np.newaxis]*im_overlays[:,:,:,:3], axis=0) \
+             + trans[0][:,:,np.newaxis]*im_background[:,:,:3]
+
+    return im_out
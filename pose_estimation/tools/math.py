@@ -1,31 +1,176 @@
 import math
 import numpy as np
 
+# rotations are vectorized: angles can be scalars, in which case a rotation
+# matrix has size (3, 3), or arrays of size (n), in which case rotation
+# matrices are stacked to size (n, 3, 3), quaternions (w, x, y, z) have size
+# (4) or (4, n) (i.e. one quaternion per column, like RenderProperties.quat)
+
+def axis_rotation(theta, i):
+    '''
+    rotate about the i'th axis (0: x, 1: y, 2: z)
+    '''
+    theta = np.asarray(theta, dtype=float)
+    c = np.cos(theta)
+    s = np.sin(theta)
+    j = (i + 1) % 3
+    k = (i + 2) % 3
+    R = np.zeros(theta.shape + (3, 3))
+    R[...,i,i] = 1
+    R[...,j,j] = c
+    R[...,j,k] = -s
+    R[...,k,j] = s
+    R[...,k,k] = c
+    return R
+
+
 def R_x(theta):
     '''
     rotate about x-axis
     '''
-    return np.array([[1, 0, 0],
-                     [0, np.cos(theta), -np.sin(theta)],
-                     [0, np.sin(theta), np.cos(theta)]])
+    return axis_rotation(theta, 0)
 
 
 def R_y(theta):
     '''
     rotate about y-axis
     '''
-    return np.array([[np.cos(theta), 0, np.sin(theta)],
-                     [0, 1, 0],
-                     [-np.sin(theta), 0, np.cos(theta)]])
+    return axis_rotation(theta, 1)
 
 
 def R_z(theta):
     '''
     rotate about z-axis
     '''
-    return np.array([[np.cos(theta), -np.sin(theta), 0],
-                     [np.sin(theta), np.cos(theta), 0],
-                     [0, 0, 1]])
+    return axis_rotation(theta, 2)
+
+
+def quat2mat(quat):
+    '''
+    rotation matrices of unit quaternions
+
+    input: quat, size (4) or (4, n)
+    output: R, size (3, 3) or (n, 3, 3)
+    '''
+    w, x, y, z = np.asarray(quat, dtype=float)
+    R = np.stack((
+        1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y),
+        2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x),
+        2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y)), axis=-1)
+    return np.reshape(R, R.shape[:-1] + (3, 3))
+
+
+def mat2quat(R):
+    '''
+    unit quaternions of rotation matrices, with w >= 0 (the same method and
+    convention as transforms3d.quaternions.mat2quat)
+
+    input: R, size (3, 3) or (n, 3, 3)
+    output: quat, size (4) or (4, n)
+    '''
+    R = np.asarray(R, dtype=float)
+    Qxx, Qyx, Qzx = R[...,0,0], R[...,0,1], R[...,0,2]
+    Qxy, Qyy, Qzy = R[...,1,0], R[...,1,1], R[...,1,2]
+    Qxz, Qyz, Qzz = R[...,2,0], R[...,2,1], R[...,2,2]
+
+    # symmetric matrix whose eigenvector of the largest eigenvalue is the
+    # quaternion (only the lower triangle is used by eigh)
+    K = np.zeros(R.shape[:-2] + (4, 4))
+    K[...,0,0] = Qxx - Qyy - Qzz
+    K[...,1,0] = Qyx + Qxy
+    K[...,1,1] = Qyy - Qxx - Qzz
+    K[...,2,0] = Qzx + Qxz
+    K[...,2,1] = Qzy + Qyz
+    K[...,2,2] = Qzz - Qxx - Qyy
+    K[...,3,0] = Qyz - Qzy
+    K[...,3,1] = Qzx - Qxz
+    K[...,3,2] = Qxy - Qyx
+    K[...,3,3] = Qxx + Qyy + Qzz
+    vals, vecs = np.linalg.eigh(K/3.0)
+    q = vecs[...,[3, 0, 1, 2],3] # eigenvalues are in ascending order
+    q = q*np.where(q[...,:1] < 0, -1, 1)
+    return np.moveaxis(q, -1, 0)
+
+
+def quat_mult(q1, q2):
+    '''
+    product of quaternions q1*q2, sizes (4) or (4, n)
+    '''
+    w1, x1, y1, z1 = np.asarray(q1, dtype=float)
+    w2, x2, y2, z2 = np.asarray(q2, dtype=float)
+    return np.stack((
+        w1*w2 - x1*x2 - y1*y2 - z1*z2,
+        w1*x2 + x1*w2 + y1*z2 - z1*y2,
+        w1*y2 - x1*z2 + y1*w2 + z1*x2,
+        w1*z2 + x1*y2 - y1*x2 + z1*w2))
+
+
+def euler2mat(ai, aj, ak, axes='sxyz'):
+    '''
+    rotation matrices of euler angles, axes is a string like those of
+    transforms3d.euler: 's' (static axes) or 'r' (rotating axes) and the
+    three axes, e.g. 'sxyz', 'rzxz'
+    '''
+    inds = ['xyz'.index(a) for a in axes[1:]]
+    R_i = axis_rotation(ai, inds[0])
+    R_j = axis_rotation(aj, inds[1])
+    R_k = axis_rotation(ak, inds[2])
+    if axes[0] == 's':
+        return R_k @ R_j @ R_i
+    return R_i @ R_j @ R_k
+
+
+def euler2quat(ai, aj, ak, axes='sxyz'):
+    '''
+    unit quaternions of euler angles, see euler2mat()
+    '''
+    return mat2quat(euler2mat(ai, aj, ak, axes))
+
+
+def mat2euler(R, axes='sxyz'):
+    '''
+    euler angles of rotation matrices, see euler2mat() (the same method as
+    transforms3d.euler.mat2euler)
+
+    input: R, size (3, 3) or (n, 3, 3)
+    output: ai, aj, ak, scalars or size (n)
+    '''
+    R = np.asarray(R, dtype=float)
+
+    # a rotating axes sequence is the reversed static axes sequence
+    if axes[0] == 's':
+        seq = axes[1:]
+        frame = 0
+    else:
+        seq = axes[:0:-1]
+        frame = 1
+    i = 'xyz'.index(seq[0])
+    parity = int('xyz'.index(seq[1]) != (i + 1) % 3)
+    repetition = seq[0] == seq[2]
+    j = (i + 1 + parity) % 3
+    k = (i + 2 - parity) % 3
+
+    eps = 4*np.finfo(float).eps
+    if repetition:
+        sy = np.hypot(R[...,i,j], R[...,i,k])
+        big = sy > eps
+        ax = np.where(big, np.arctan2(R[...,i,j], R[...,i,k]),
+                      np.arctan2(-R[...,j,k], R[...,j,j]))
+        ay = np.arctan2(sy, R[...,i,i])
+        az = np.where(big, np.arctan2(R[...,j,i], -R[...,k,i]), 0.0)
+    else:
+        cy = np.hypot(R[...,i,i], R[...,j,i])
+        big = cy > eps
+        ax = np.where(big, np.arctan2(R[...,k,j], R[...,k,k]),
+                      np.arctan2(-R[...,j,k], R[...,j,j]))
+        ay = np.arctan2(-R[...,k,i], cy)
+        az = np.where(big, np.arctan2(R[...,j,i], R[...,i,i]), 0.0)
+
+    if parity:
+        ax, ay, az = -ax, -ay, -az
+    if frame:
+        ax, az = az, ax
+    return ax[()], ay[()], az[()]
 
 
 def normalize_array(arr):
@@ -0,0 +1,70 @@
+'''
+per-job scratch directories, placed on a tmpfs (i.e. in memory) when one is
+available
+'''
+import os
+import shutil
+import tempfile
+import contextlib
+
+# tmpfs mount points to prefer, in order
+preferred_tmpfs = ['/dev/shm', '/run/shm', '/tmp']
+
+
+def find_tmpfs():
+    '''
+    find a writable tmpfs mount point, return None if there is none
+    '''
+
+    # tmpfs mount points, from /proc/mounts (linux only)
+    mounts = []
+    try:
+        with open('/proc/mounts', 'r') as input:
+            for line in input:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] == 'tmpfs':
+                    mounts.append(fields[1])
+    except OSError:
+        return None
+
+    # use a preferred mount point if possible, then any other one
+    candidates = [m for m in preferred_tmpfs if m in mounts] + \
+                 [m for m in mounts if m not in preferred_tmpfs]
+    for mount in candidates:
+        if os.access(mount, os.W_OK | os.X_OK):
+            return mount
+
+    return None
+
+
+def scratch_root(root=None):
+    '''
+    directory in which scratch directories are created: root if it is given,
+    otherwise a tmpfs if one is found, otherwise the system temp directory
+    '''
+
+    if root is not None:
+        return root
+
+    tmpfs = find_tmpfs()
+    if tmpfs is not None:
+        return tmpfs
+
+    return tempfile.gettempdir()
+
+
+@contextlib.contextmanager
+def scratch_dir(root=None, prefix='pose_estimation_'):
+    '''
+    create a unique scratch directory (so concurrent jobs never write to the
+    same files), and remove it and its contents when the context exits
+    '''
+
+    root = scratch_root(root)
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    path = tempfile.mkdtemp(prefix=prefix, dir=root)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
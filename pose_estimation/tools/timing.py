@@ -0,0 +1,241 @@
+'''
+timers, counters, and optional cProfile capture for the render pipeline
+
+when the tracer is enabled, every timed span is written to a trace file as one
+json object per line, in the Chrome trace event format (so a trace can also be
+viewed with chrome://tracing, see write_chrome_trace()), when it is disabled,
+spans and counters do nothing
+
+to summarize the traces of a sweep (and optionally combine them into one
+Chrome trace file), run:
+python -m pose_estimation.tools.timing [--chrome out.json] trace_file [...]
+'''
+import os
+import sys
+import json
+import time
+import cProfile
+import functools
+import threading
+import contextlib
+
+
+class Tracer:
+
+    def __init__(self):
+        self.trace_file = None
+        self.output = None
+        self.counters = {}
+        self.profile_file = None
+        self.profiler = None
+        self.lock = threading.Lock() # spans can be written by any thread
+
+    def enabled(self):
+        '''
+        check if the tracer is writing a trace
+        '''
+
+        return self.output is not None
+
+    def enable(self, trace_file, profile_file=None):
+        '''
+        start writing a trace to trace_file (which is appended to), and if
+        profile_file is given, also run cProfile and save its stats there
+        '''
+
+        if self.enabled():
+            self.disable()
+
+        self.trace_file = trace_file
+        self.output = open(trace_file, 'a')
+        self.counters = {}
+        if profile_file is not None:
+            self.profile_file = profile_file
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def disable(self):
+        '''
+        write the counters to the trace, close it, and save cProfile stats
+        '''
+
+        if not self.enabled():
+            return
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_file)
+            self.profiler = None
+            self.profile_file = None
+
+        if self.counters:
+            self.write({'name': 'counters', 'ph': 'C', 'ts': now_us(),
+                        'pid': os.getpid(), 'tid': threading.get_ident(),
+                        'args': self.counters})
+        self.output.close()
+        self.output = None
+        self.trace_file = None
+
+    def write(self, event):
+        '''
+        write one event to the trace
+        '''
+
+        with self.lock:
+            self.output.write(json.dumps(event) + '\n')
+            self.output.flush()
+
+    def add_span(self, name, t_start, t_end, **args):
+        '''
+        write a span which has already been timed (times in seconds since the
+        epoch, i.e. from time.time())
+        '''
+
+        if not self.enabled():
+            return
+
+        self.write({'name': name, 'ph': 'X', 'ts': int(t_start*1e6),
+                    'dur': int((t_end - t_start)*1e6), 'pid': os.getpid(),
+                    'tid': threading.get_ident(), 'args': args})
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        '''
+        time the code in a with block, e.g.
+        with tracer.span('render'):
+            ...
+        '''
+
+        if not self.enabled():
+            yield
+            return
+
+        t_start = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(name, t_start, time.time(), **args)
+
+    def timed(self, name):
+        '''
+        decorator which times every call of a function, e.g.
+        @tracer.timed('render')
+        def render(...):
+            ...
+        '''
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+
+        return decorator
+
+    def count(self, name, n=1):
+        '''
+        add n to a counter
+        '''
+
+        if not self.enabled():
+            return
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+
+def now_us():
+    '''
+    time since the epoch in microseconds
+    '''
+
+    return int(time.time()*1e6)
+
+
+# the tracer of this process, and shortcuts to it
+tracer = Tracer()
+span = tracer.span
+timed = tracer.timed
+count = tracer.count
+
+
+def read_trace(trace_file):
+    '''
+    read all events of a trace file
+    '''
+
+    events = []
+    with open(trace_file, 'r') as input:
+        for line in input:
+            if line.strip():
+                events.append(json.loads(line))
+
+    return events
+
+
+def summarize(trace_files):
+    '''
+    combine the traces of a sweep (e.g. one trace per job)
+
+    output: a dictionary with
+        'spans': for each span name, a dictionary with the number of spans,
+                 and the total, mean, and max time (in seconds)
+        'counters': the sum of each counter over all traces
+    '''
+
+    spans = {}
+    counters = {}
+    for trace_file in trace_files:
+        for event in read_trace(trace_file):
+            if event['ph'] == 'X':
+                dur = event['dur']/1e6
+                sp = spans.setdefault(event['name'],
+                                      {'count': 0, 'total': 0.0, 'max': 0.0})
+                sp['count'] += 1
+                sp['total'] += dur
+                sp['max'] = max(sp['max'], dur)
+            elif event['ph'] == 'C':
+                for key, val in event['args'].items():
+                    counters[key] = counters.get(key, 0) + val
+
+    for sp in spans.values():
+        sp['mean'] = sp['total']/sp['count']
+
+    return {'spans': spans, 'counters': counters}
+
+
+def print_summary(summary):
+    '''
+    print a summary from summarize(), spans with the largest total time first
+    '''
+
+    print('%-28s %8s %12s %12s %12s' % ('span', 'count', 'total (s)',
+                                        'mean (s)', 'max (s)'))
+    spans = sorted(summary['spans'].items(), key=lambda kv: -kv[1]['total'])
+    for name, sp in spans:
+        print('%-28s %8d %12.3f %12.5f %12.5f' % (name, sp['count'],
+              sp['total'], sp['mean'], sp['max']))
+    for name, val in sorted(summary['counters'].items()):
+        print('%-28s %8d' % (name, val))
+
+
+def write_chrome_trace(trace_files, chrome_file):
+    '''
+    combine trace files into one file which can be opened in chrome://tracing
+    '''
+
+    events = []
+    for trace_file in trace_files:
+        events += read_trace(trace_file)
+
+    with open(chrome_file, 'w') as output:
+        json.dump({'traceEvents': events}, output)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] == '--chrome':
+        write_chrome_trace(args[2:], args[1])
+        args = args[2:]
+    print_summary(summarize(args))
@@ -0,0 +1,177 @@
+'''
+tests of pose_estimation/blender/executor.py with several local worker
+processes, blender is replaced by a fake blender command which marks each job
+as rendered (and fails for jobs which are told to)
+'''
+import os
+import sys
+import time
+import stat
+import multiprocessing
+
+import pytest
+
+import pose_estimation.blender.executor as be
+import pose_estimation.blender.manifest as bm
+from pose_estimation.blender.render_properties import RenderProperties
+
+# fake blender: for each job directory after '--', append the worker's pid
+# (blender's parent) to its 'rendered' file, and exit with an error if its
+# 'fail' file holds a nonzero count (-1 is every time, n > 0 is the next n
+# times)
+fake_blender = '''#!%s
+import os
+import sys
+import time
+
+job_dirs = sys.argv[sys.argv.index('--') + 1:]
+for job_dir in job_dirs:
+    with open(os.path.join(job_dir, 'rendered'), 'a') as output:
+        output.write('%%d\\n' %% os.getppid())
+    fail_file = os.path.join(job_dir, 'fail')
+    if os.path.isfile(fail_file):
+        with open(fail_file, 'r') as input:
+            n_fail = int(input.read())
+        if n_fail != 0:
+            if n_fail > 0:
+                with open(fail_file, 'w') as output:
+                    output.write(str(n_fail - 1))
+            sys.exit(1)
+    time.sleep(float(os.environ.get('FAKE_BLENDER_TIME', '0.05')))
+''' % sys.executable
+
+
+@pytest.fixture
+def queue(tmpdir, monkeypatch):
+    '''
+    the file of an empty queue database, with the fake blender on the path
+    '''
+
+    bin_dir = tmpdir.mkdir('bin')
+    blender = bin_dir.join('blender')
+    blender.write(fake_blender)
+    os.chmod(str(blender), os.stat(str(blender)).st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep +
+                       os.environ['PATH'])
+    monkeypatch.setattr(be, 'poll_time', 0.1)
+
+    return str(tmpdir.join('queue.db'))
+
+
+def make_jobs(tmpdir, n_jobs, n_fail=0):
+    '''
+    job directories with manifests, whose fake renders fail n_fail times
+    '''
+
+    job_dirs = []
+    for i in range(n_jobs):
+        job_dir = str(tmpdir.mkdir('job_%06d' % i))
+        bm.write_manifest(RenderProperties(), job_dir)
+        if n_fail:
+            with open(os.path.join(job_dir, 'fail'), 'w') as output:
+                output.write(str(n_fail))
+        job_dirs.append(job_dir)
+
+    return job_dirs
+
+
+def rendered_by(job_dir):
+    '''
+    pids of the workers which rendered a job
+    '''
+
+    rendered_file = os.path.join(job_dir, 'rendered')
+    if not os.path.isfile(rendered_file):
+        return []
+    with open(rendered_file, 'r') as input:
+        return [int(line) for line in input]
+
+
+def run_with_timeout(target, args, timeout=60):
+    '''
+    run target(*args) in a process, and fail if it does not finish in time
+    (e.g. because a worker never sees the queue as finished)
+    '''
+
+    proc = multiprocessing.Process(target=target, args=args)
+    proc.start()
+    proc.join(timeout)
+    if proc.is_alive():
+        proc.terminate()
+        pytest.fail('%s did not finish in %g s' % (target.__name__, timeout))
+
+
+def test_workers_steal(tmpdir, queue, monkeypatch):
+    # one shard, so the second worker only has work if it steals
+    job_dirs = make_jobs(tmpdir, 8)
+    be.submit(queue, job_dirs, size=8)
+    monkeypatch.setenv('FAKE_BLENDER_TIME', '0.3')
+    run_with_timeout(be.run_local, (queue, 2, 30, 3, 1, None))
+
+    stat = be.status(queue)
+    assert stat[be.DONE]['jobs'] == 8
+    assert stat[be.FAILED]['shards'] == 0
+    assert all(len(rendered_by(job_dir)) == 1 for job_dir in job_dirs)
+    workers = set(rendered_by(job_dir)[0] for job_dir in job_dirs)
+    assert len(workers) == 2
+    assert stat[be.DONE]['shards'] >= 2 # the stolen part is a new shard
+
+
+def test_retry_after_failure(tmpdir, queue):
+    job_dirs = make_jobs(tmpdir, 2, n_fail=1)
+    be.submit(queue, job_dirs, size=2)
+    run_with_timeout(be.run_local, (queue, 2, 30, 3, 2, None))
+
+    stat = be.status(queue)
+    assert stat[be.DONE]['jobs'] == 2
+    n_jobs = sum(w['jobs'] for w in stat['workers'].values())
+    n_failed = sum(w['failed_runs'] for w in stat['workers'].values())
+    assert n_jobs == 2 # failed runs are not counted as rendered jobs
+    assert n_failed == 2 # each job fails the first run it is in
+
+
+def test_max_attempts(tmpdir, queue):
+    job_dirs = make_jobs(tmpdir, 1, n_fail=-1)
+    be.submit(queue, job_dirs)
+    run_with_timeout(be.run_local, (queue, 2, 30, 2, 1, None))
+
+    stat = be.status(queue)
+    assert stat[be.FAILED]['shards'] == 1
+    assert len(rendered_by(job_dirs[0])) == 2
+    assert sum(w['jobs'] for w in stat['workers'].values()) == 0
+
+
+def expire(queue, attempts):
+    '''
+    make the shard look like it was claimed attempts times, most recently by
+    a worker which died, whose lease has expired
+    '''
+
+    con = be.connect(queue)
+    with be.transaction(con):
+        con.execute('update shards set state=?, worker=?, lease=?, '
+                    'attempts=?', (be.RUNNING, 'dead:0', time.time() - 1,
+                                   attempts))
+    con.close()
+
+
+def test_expired_lease_is_rendered_again(tmpdir, queue):
+    job_dirs = make_jobs(tmpdir, 2)
+    be.submit(queue, job_dirs)
+    expire(queue, 1)
+    run_with_timeout(be.run_worker, (queue, 30, 3, 2))
+
+    stat = be.status(queue)
+    assert stat[be.DONE]['jobs'] == 2
+
+
+def test_expired_lease_on_last_attempt(tmpdir, queue):
+    job_dirs = make_jobs(tmpdir, 2)
+    be.submit(queue, job_dirs)
+    expire(queue, 3)
+    run_with_timeout(be.run_worker, (queue, 30, 3, 2))
+
+    stat = be.status(queue)
+    assert stat[be.FAILED]['shards'] == 1
+    assert stat['errors'] == {1: 'lease expired'}
+    assert rendered_by(job_dirs[0]) == []
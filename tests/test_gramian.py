@@ -0,0 +1,102 @@
+'''
+tests of the gramian computation of pose_estimation/gramian/functions.py
+(decode_state() and finish_gramian(), through gramian_from_images()) against
+scl*mat.T @ mat computed directly in float64, on synthetic png images
+'''
+import os
+import imageio
+import numpy as np
+import pytest
+
+import pose_estimation.gramian.functions as gf
+
+n_states = 6
+n_cams = 2
+eps = 1e-2
+shape = (12, 16, 3)
+
+
+def write_images(tmpdir, noise_floor):
+    '''
+    random perturbation images of every state and camera, which only differ
+    in a patch (like renders of a small object), and the direct gramian and
+    noise floor of each camera
+
+    outputs:
+        image_files: input of gf.gramian_from_images()
+        gram_cams, noise_cams: size (n_states, n_states, n_cams)
+    '''
+
+    rng = np.random.RandomState(0)
+    im_nom = rng.randint(0, 256, shape)
+    image_files = []
+    diffs = np.zeros((shape[0]*shape[1]*3, n_states, n_cams))
+    diffs_b = np.zeros(diffs.shape)
+    for j in range(n_states):
+        files_j = []
+        for name in ['neg', 'pos', 'neg_b', 'pos_b']:
+            if name.endswith('_b') and not noise_floor:
+                files_j.append(None)
+                continue
+            files_j.append([])
+            for c in range(n_cams):
+                im = im_nom.copy()
+                im[2:6,3:9] = rng.randint(0, 256, (4, 6, 3))
+                im_file = str(tmpdir.join('%s_%d_%d.png' % (name, j, c)))
+                imageio.imwrite(im_file, np.uint8(im))
+                files_j[-1].append(im_file)
+
+                # y^+ - y^- on the interval [0, 1]
+                sign = 1 if name.startswith('pos') else -1
+                if name.endswith('_b'):
+                    diffs_b[:,j,c] += sign*np.ravel(im)/255.0
+                else:
+                    diffs[:,j,c] += sign*np.ravel(im)/255.0
+        image_files.append(tuple(files_j))
+
+    scl = 1/(4*eps**2)
+    gram_cams = np.zeros((n_states, n_states, n_cams))
+    noise_cams = np.zeros((n_states, n_states, n_cams))
+    for c in range(n_cams):
+        gram_cams[:,:,c] = scl*diffs[:,:,c].T @ diffs[:,:,c]
+        noise = diffs[:,:,c] - diffs_b[:,:,c]
+        noise_cams[:,:,c] = (scl/2)*noise.T @ noise
+
+    return image_files, gram_cams, noise_cams
+
+
+@pytest.mark.parametrize('use_int_diff', [False, True])
+@pytest.mark.parametrize('use_sparse', [False, True])
+@pytest.mark.parametrize('noise_floor', [False, True])
+def test_gramian_from_images(tmpdir, use_int_diff, use_sparse, noise_floor):
+    image_files, gram_cams, noise_cams = write_images(tmpdir, noise_floor)
+    if use_sparse:
+        deltas_files = [str(tmpdir.join('deltas_cam%d.npz' % c))
+                        for c in range(n_cams)]
+    else:
+        deltas_files = None
+
+    gram, noise, gram_cams_out = gf.gramian_from_images(
+        image_files, eps, use_int_diff=use_int_diff, use_sparse=use_sparse,
+        deltas_files=deltas_files)
+
+    # integer differences are exact, float32 images are not
+    rtol = 1e-12 if use_int_diff else 1e-5
+    assert np.allclose(gram_cams_out, gram_cams, rtol=rtol, atol=0)
+    assert np.allclose(gram, np.sum(gram_cams, axis=2), rtol=rtol, atol=0)
+    if noise_floor:
+        assert np.allclose(noise, np.sum(noise_cams, axis=2), rtol=rtol,
+                           atol=0)
+    else:
+        assert noise is None
+
+    # the images are removed, and the sparse differences are saved, only with
+    # the rows of the patch
+    assert not [f for f in os.listdir(str(tmpdir)) if f.endswith('.png')]
+    if use_sparse:
+        for c in range(n_cams):
+            deltas = np.load(deltas_files[c])
+            assert deltas['ind'].size <= 4*6*3
+            mat = deltas['mat'].astype(np.float64)
+            assert np.allclose(deltas['scl']*mat.T @ mat, gram_cams[:,:,c],
+                               rtol=rtol, atol=0)
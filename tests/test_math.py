@@ -0,0 +1,68 @@
+'''
+tests of pose_estimation/tools/math.py against transforms3d, whose conventions
+it follows, for single and batched inputs
+'''
+import numpy as np
+import pytest
+import transforms3d as t3d
+
+import pose_estimation.tools.math as tm
+
+# all axis sequences of transforms3d.euler
+axes_all = sorted(t3d.euler._AXES2TUPLE.keys())
+
+# random unit quaternions, and angles which include the singular ones
+rng = np.random.RandomState(0)
+n = 50
+quat = rng.randn(4, n)
+quat = quat/np.linalg.norm(quat, axis=0)
+ang = rng.uniform(-np.pi, np.pi, (3, n))
+ang[1,:5] = [0, np.pi/2, -np.pi/2, np.pi, 0]
+
+
+def test_quat2mat():
+    R = tm.quat2mat(quat)
+    for i in range(n):
+        R_t3d = t3d.quaternions.quat2mat(quat[:,i])
+        assert np.allclose(tm.quat2mat(quat[:,i]), R_t3d, atol=1e-14)
+        assert np.allclose(R[i], R_t3d, atol=1e-14)
+
+
+def test_mat2quat():
+    R = np.stack([t3d.quaternions.quat2mat(quat[:,i]) for i in range(n)])
+    q = tm.mat2quat(R)
+    for i in range(n):
+        q_t3d = t3d.quaternions.mat2quat(R[i])
+        assert np.allclose(tm.mat2quat(R[i]), q_t3d, atol=1e-14)
+        assert np.allclose(q[:,i], q_t3d, atol=1e-14)
+
+
+def test_quat_mult():
+    q2 = quat[:,::-1]
+    q = tm.quat_mult(quat, q2)
+    for i in range(n):
+        q_t3d = t3d.quaternions.qmult(quat[:,i], q2[:,i])
+        assert np.allclose(tm.quat_mult(quat[:,i], q2[:,i]), q_t3d,
+                           atol=1e-14)
+        assert np.allclose(q[:,i], q_t3d, atol=1e-14)
+
+
+@pytest.mark.parametrize('axes', axes_all)
+def test_euler2mat(axes):
+    R = tm.euler2mat(ang[0], ang[1], ang[2], axes)
+    for i in range(n):
+        R_t3d = t3d.euler.euler2mat(ang[0,i], ang[1,i], ang[2,i], axes)
+        assert np.allclose(tm.euler2mat(ang[0,i], ang[1,i], ang[2,i], axes),
+                           R_t3d, atol=1e-14)
+        assert np.allclose(R[i], R_t3d, atol=1e-14)
+
+
+@pytest.mark.parametrize('axes', axes_all)
+def test_mat2euler(axes):
+    R = np.stack([t3d.euler.euler2mat(ang[0,i], ang[1,i], ang[2,i], axes)
+                  for i in range(n)])
+    ai, aj, ak = tm.mat2euler(R, axes)
+    for i in range(n):
+        ang_t3d = t3d.euler.mat2euler(R[i], axes)
+        assert np.allclose(tm.mat2euler(R[i], axes), ang_t3d, atol=1e-12)
+        assert np.allclose((ai[i], aj[i], ak[i]), ang_t3d, atol=1e-12)
@@ -0,0 +1,141 @@
+'''
+tests of pose_estimation/gramian/symmetry.py: the Gramians of a sweep which
+are found from the poses related to them by a symmetry are compared to
+Gramians computed by finite differences at every pose, with images replaced by
+the pinhole projections of the points of a symmetric object
+'''
+import os
+import math
+import numpy as np
+
+import pose_estimation.tools.math as tm
+import pose_estimation.gramian.functions as gf
+import pose_estimation.gramian.symmetry as gs
+
+# points of an object with 4-fold symmetry about z and mirror planes: a square
+# with an arrow at each corner (the arrows are not symmetric about the
+# diagonals, so the object has no other symmetries)
+corner = np.array([[1.0, 1.0, 0.0], [1.3, 1.0, 0.2], [1.0, 1.1, -0.3]])
+points = np.concatenate([corner @ gs.axis_rotation(
+    {'axis': 'z'}, k*math.pi/2).T for k in range(4)])
+points = np.concatenate((points, points*[1, -1, 1])).T
+sym = {'axis': 'z', 'order': 4, 'mirror': True}
+
+
+def image(xyz, R, cam_xyz, cam_R):
+    '''
+    pinhole projections of the points of the object, which stand in for its
+    image (the camera looks along its -z axis)
+    '''
+
+    co = cam_R.T @ (R @ points + xyz[:,np.newaxis] - cam_xyz[:,np.newaxis])
+
+    return np.concatenate((co[0]/-co[2], co[1]/-co[2]))
+
+
+def gramian(xyz, quat, cam_xyz, cam_quat, eps=1e-5):
+    '''
+    empirical observability Gramian of a pose, by central differences
+    '''
+
+    pert_xyz, pert_quat = gf.standard_pert(xyz, quat, eps)
+    cam_R = tm.quat2mat(cam_quat)
+    diffs = []
+    for j in range(6):
+        y_minus = image(pert_xyz[:,2*j], tm.quat2mat(pert_quat[:,2*j]),
+                        cam_xyz, cam_R)
+        y_plus = image(pert_xyz[:,2*j+1], tm.quat2mat(pert_quat[:,2*j+1]),
+                       cam_xyz, cam_R)
+        diffs.append(y_plus - y_minus)
+    mat = np.column_stack(diffs)
+
+    return mat.T @ mat/(4*eps**2)
+
+
+def sweep():
+    '''
+    camera poses around the object (like best_views.py), at two poses of the
+    object
+    '''
+
+    ang_azi = np.linspace(0, 2*math.pi, 16, endpoint=False)
+    ang_ele = np.array([0.3, math.pi/2])
+    ang_azi_all = np.tile(np.repeat(ang_azi, ang_ele.size), 2)
+    ang_ele_all = np.tile(ang_ele, 2*ang_azi.size)
+    n = ang_azi_all.size
+
+    # object poses, the second one is rotated about its own z axis (so the
+    # sweep around it is related to the first one by a symmetry)
+    xyz = np.tile(np.array([[0.5], [-0.2], [0.3]]), n)
+    quat_0 = tm.mat2quat(tm.euler2mat(0.2, -0.4, 0.1, 'sxyz'))
+    quat_1 = tm.mat2quat(tm.euler2mat(0.2, -0.4, 0.1, 'sxyz') @
+                         tm.R_z(math.pi/2))
+    quat = np.column_stack([quat_0]*(n//2) + [quat_1]*(n//2))
+
+    # cameras orbiting the object, in the object's frame
+    R_obj = tm.quat2mat(quat)
+    R_orbit = tm.R_z(ang_azi_all) @ tm.R_x(-ang_ele_all)
+    cam_R = R_obj @ R_orbit @ tm.euler2mat(math.pi/2, 0, 0, 'sxyz')
+    cam_xyz = xyz + (R_obj @ R_orbit @ np.array([[0], [-6], [0]]))[:,:,0].T
+    cam_quat = tm.mat2quat(cam_R)
+
+    return xyz, quat, cam_xyz, cam_quat
+
+
+def test_reduce_sweep_matches_finite_differences():
+    xyz, quat, cam_xyz, cam_quat = sweep()
+    n = xyz.shape[1]
+    gram = np.stack([gramian(xyz[:,i], quat[:,i], cam_xyz[:,i],
+                             cam_quat[:,i]) for i in range(n)], axis=2)
+
+    src, T = gs.reduce_sweep(sym, xyz, quat, cam_xyz, cam_quat)
+    assert np.sum(src == np.arange(n)) < n/4 # most poses are not rendered
+    for i in range(n):
+        gram_i = gs.transform_gramian(gram[:,:,src[i]], T[:,:,i])
+        scl = np.linalg.norm(gram[:,:,i])
+        assert np.allclose(gram_i, gram[:,:,i], atol=1e-6*scl)
+
+
+def test_reduce_sweep_without_symmetry():
+    xyz, quat, cam_xyz, cam_quat = sweep()
+    src, T = gs.reduce_sweep(None, xyz, quat, cam_xyz, cam_quat)
+    n = xyz.shape[1]
+
+    # the sweep only repeats relative poses with the rotated object
+    assert np.array_equal(src[:n//2], np.arange(n//2))
+
+
+def test_detect_symmetry():
+    assert gs.detect_symmetry(points) == sym
+
+    # a lamp on the axis keeps the symmetry, a lamp off the axis breaks it
+    dir_down = np.array([[0], [0], [-1]])
+    assert gs.detect_symmetry(points, np.array([[0], [0], [5]]),
+                              dir_down) == sym
+    assert gs.detect_symmetry(points, np.array([[3], [1], [5]]),
+                              dir_down) is None
+
+    # four lamps at the corners keep it
+    lamp_xyz = np.array([[4, 0, -4, 0], [0, 4, 0, -4], [3, 3, 3, 3]])
+    assert gs.detect_symmetry(points, lamp_xyz, np.zeros((3, 4))) == sym
+
+
+def test_model_symmetry_is_cached(tmpdir, monkeypatch):
+    monkeypatch.setattr(gs.dirs, 'blender_models_dir', str(tmpdir))
+    tmpdir.join('model.blend').write('')
+    calls = []
+
+    def detect(model_names):
+        calls.append(model_names)
+        gs.save_symmetry('model', sym)
+
+    monkeypatch.setattr(gs.br, 'blender_detect_symmetry', detect)
+    assert gs.model_symmetry('model') == sym
+    assert gs.model_symmetry('model') == sym
+    assert calls == [['model']]
+
+    # the symmetry is detected again when the .blend file changes
+    sym_file = gs.symmetry_file('model')
+    os.utime(sym_file, (0, 0))
+    assert gs.model_symmetry('model') == sym
+    assert len(calls) == 2